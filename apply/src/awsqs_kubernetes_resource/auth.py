@@ -0,0 +1,46 @@
+import base64
+
+# An EKS bearer token is a presigned STS GetCallerIdentity URL, bound to the cluster by
+# the signed x-k8s-aws-id header, that the cluster's authenticator replays to identify
+# the caller. Tokens are accepted for 15 minutes, a kubeconfig holding one is rewritten
+# once it is older than TOKEN_TTL.
+TOKEN_PREFIX = "k8s-aws-v1."
+TOKEN_TTL = 600
+CLUSTER_ID_HEADER = "x-k8s-aws-id"
+
+
+def eks_token(session, cluster_name):
+    # a client of its own, the header is added to every GetCallerIdentity it signs
+    sts = session.client("sts")
+
+    def add_cluster_id(request, **_kwargs):
+        request.headers[CLUSTER_ID_HEADER] = cluster_name
+
+    sts.meta.events.register("before-sign.sts.GetCallerIdentity", add_cluster_id)
+    url = sts.generate_presigned_url(
+        "get_caller_identity", Params={}, ExpiresIn=60, HttpMethod="GET"
+    )
+    encoded = base64.urlsafe_b64encode(url.encode("utf-8")).decode("utf-8")
+    return TOKEN_PREFIX + encoded.rstrip("=")
+
+
+def kubeconfig(cluster, token):
+    name = cluster["name"]
+    return {
+        "apiVersion": "v1",
+        "kind": "Config",
+        "clusters": [
+            {
+                "name": name,
+                "cluster": {
+                    "server": cluster["endpoint"],
+                    "certificate-authority-data": cluster["certificateAuthority"][
+                        "data"
+                    ],
+                },
+            }
+        ],
+        "users": [{"name": name, "user": {"token": token}}],
+        "contexts": [{"name": name, "context": {"cluster": name, "user": name}}],
+        "current-context": name,
+    }
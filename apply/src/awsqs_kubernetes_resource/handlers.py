@@ -7,9 +7,13 @@ import re
 import requests
 from ruamel import yaml
 from datetime import date, datetime
-from time import sleep
+from time import sleep, time
 import os
 import base64
+import shutil
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
 
@@ -22,8 +26,24 @@ from cloudformation_cli_python_lib import (
     exceptions,
 )
 
+from . import auth, throttle
 from .models import ResourceHandlerRequest, ResourceModel
-from .vpc import proxy_needed, proxy_call, put_function
+from .profiling import profile_handler, profile_proxy, timed
+from .waves import api_group, describe, object_namespace, plan_waves
+from .vpc import (
+    describe_cluster,
+    proxy_needed,
+    proxy_call,
+    proxy_call_async,
+    check_proxy_response,
+    configure_throttle,
+    delete_proxy_result,
+    get_proxy_result,
+    put_proxy_result,
+    put_function,
+    record_duration,
+    ASYNC_EVENT_AGE,
+)
 
 # Use this logger to forward log messages to CloudWatch Logs.
 LOG = logging.getLogger(__name__)
@@ -35,8 +55,37 @@ test_entrypoint = resource.test_entrypoint
 
 s3_scheme = re.compile(r"^s3://.+/.+")
 
+# asynchronous lambda invocations are limited to a 256KB payload, larger manifests are
+# proxied synchronously
+ASYNC_PAYLOAD_LIMIT = 240 * 1024
+# longest an asynchronous proxy invocation may wait to start and then run, plus some
+# slack for the result to be written
+ASYNC_TIMEOUT = ASYNC_EVENT_AGE + 900 + 60
+# the object metadata build_model reads, all a proxy returns for asynchronous commands
+MODEL_METADATA = ["uid", "selfLink", "resourceVersion", "namespace", "name"]
+# maximum number of objects created concurrently within an apply wave
+MAX_WAVE_WORKERS = 8
+
+# cluster whose context is currently active in /tmp/kube.config, kept across warm
+# invocations so that kubeconfig generation only happens once per container, and when
+# the token in it is due to be replaced, along with the session to replace it with
+kubeconfig_cluster = None
+kubeconfig_expires = 0
+kubeconfig_session = None
+
+# kubectl discovery and OpenAPI cache for the active cluster, per server version. Lambda
+# has no persistent ~/.kube/cache, so without it every command starts with a full
+# discovery of the apiserver.
+KUBE_CACHE_ROOT = "/tmp/kube-cache"
+KUBE_CACHE_TTL = 3600
+STALE_DISCOVERY = re.compile(
+    r"the server doesn't have a resource type|no matches for kind"
+)
+kube_cache_dir = None
+
 
 @resource.handler(Action.CREATE)
+@profile_handler
 def create_handler(
     session: Optional[SessionProxy],
     request: ResourceHandlerRequest,
@@ -50,11 +99,14 @@ def create_handler(
     physical_resource_id, manifest_file, manifest_dict = handler_init(
         model, session, request.logicalResourceIdentifier, request.clientRequestToken
     )
+    primary = primary_document(manifest_dict)
+    # read and delete look for the primary object where it is actually created
     model.CfnId = encode_id(
         request.clientRequestToken,
         model.ClusterName,
-        model.Namespace,
-        manifest_dict["kind"],
+        object_namespace(primary, model.Namespace) or "default",
+        primary["kind"],
+        manifest_dict.get("kind") == "List",
     )
     if not callback_context:
         LOG.debug("1st invoke")
@@ -75,12 +127,26 @@ def create_handler(
             LOG.debug(f"stabilizing: {progress.__dict__}")
             return progress
     try:
-        outp = run_command(
-            "kubectl create --save-config -o json -f %s -n %s"
-            % (manifest_file, model.Namespace),
-            model.ClusterName,
-            session,
-        )
+        if manifest_dict.get("kind") == "List":
+            outp = create_waves(
+                manifest_dict["items"], model, session, callback_context
+            )
+        else:
+            command = f"kubectl create --save-config -o json -f {manifest_file}"
+            if object_namespace(primary, model.Namespace):
+                command += f" -n {object_namespace(primary, model.Namespace)}"
+            outp = run_command_async(
+                command,
+                model.ClusterName,
+                session,
+                callback_context,
+            )
+        if outp is None:
+            progress.callbackContext = callback_context
+            # the next wave can start straight away, a proxy needs time to finish
+            progress.callbackDelaySeconds = 1 if "wave" in callback_context else 10
+            LOG.debug(f"waiting for proxy or next wave: {progress.__dict__}")
+            return progress
         build_model(json.loads(outp), model)
     except Exception as e:
         if "Error from server (AlreadyExists)" not in str(e):
@@ -101,63 +167,88 @@ def create_handler(
 
 
 @resource.handler(Action.UPDATE)
+@profile_handler
 def update_handler(
     session: Optional[SessionProxy],
     request: ResourceHandlerRequest,
-    _c: MutableMapping[str, Any],
+    callback_context: MutableMapping[str, Any],
 ) -> ProgressEvent:
     model = request.desiredResourceState
     progress: ProgressEvent = ProgressEvent(
         status=OperationStatus.IN_PROGRESS, resourceModel=model,
     )
     if not proxy_needed(model.ClusterName, session):
-        create_kubeconfig(model.ClusterName)
+        create_kubeconfig(model.ClusterName, session)
     if not get_model(model, session):
         raise exceptions.NotFound(TYPE_NAME, model.Uid)
     token, cluster_name, namespace, kind = decode_id(model.CfnId)
-    _p, manifest_file, _d = handler_init(
+    _p, manifest_file, manifest_dict = handler_init(
         model, session, request.logicalResourceIdentifier, token
     )
-    outp = run_command(
-        "kubectl apply -o json -f %s -n %s" % (manifest_file, model.Namespace),
-        model.ClusterName,
-        session,
-    )
+    if manifest_dict.get("kind") == "List":
+        outp = apply_waves(manifest_dict["items"], model, session)
+    else:
+        outp = run_command_async(
+            "kubectl apply -o json -f %s -n %s" % (manifest_file, model.Namespace),
+            model.ClusterName,
+            session,
+            callback_context,
+        )
+    if outp is None:
+        progress.callbackContext = callback_context
+        progress.callbackDelaySeconds = 10
+        return progress
     build_model(json.loads(outp), model)
     progress.status = OperationStatus.SUCCESS
     return progress
 
 
 @resource.handler(Action.DELETE)
+@profile_handler
 def delete_handler(
     session: Optional[SessionProxy],
     request: ResourceHandlerRequest,
-    _c: MutableMapping[str, Any],
+    callback_context: MutableMapping[str, Any],
 ) -> ProgressEvent:
     model = request.desiredResourceState
     progress: ProgressEvent = ProgressEvent(
-        status=OperationStatus.SUCCESS, resourceModel=model,
+        status=OperationStatus.IN_PROGRESS, resourceModel=model,
     )
     if not proxy_needed(model.ClusterName, session):
-        create_kubeconfig(model.ClusterName)
-    _p, manifest_file, _d = handler_init(
-        model, session, request.logicalResourceIdentifier, request.clientRequestToken
-    )
-    if not get_model(model, session):
-        raise exceptions.NotFound(TYPE_NAME, model.Uid)
-    try:
-        run_command(
-            "kubectl delete -f %s -n %s" % (manifest_file, model.Namespace),
-            model.ClusterName,
-            session,
-        )
-    except Exception as e:
-        if "Error from server (NotFound)" not in str(e):
-            raise
+        create_kubeconfig(model.ClusterName, session)
+    token, _c, namespace, kind = decode_id(model.CfnId)
+    if not model.Name or not model.Uid:
+        if not get_model(model, session):
+            raise exceptions.NotFound(TYPE_NAME, model.Uid)
+    if "deleting" not in callback_context:
+        if is_bundle(model.CfnId):
+            # the other objects of a multi-document manifest are only known from the
+            # manifest itself
+            if object_uid(kind, namespace, model, session) != model.Uid:
+                raise exceptions.NotFound(TYPE_NAME, model.Uid)
+            _p, _f, manifest_dict = handler_init(
+                model,
+                session,
+                request.logicalResourceIdentifier,
+                request.clientRequestToken,
+            )
+            delete_documents(manifest_dict["items"], model, session, token)
+        elif not delete_object(kind, namespace, model, session):
+            raise exceptions.NotFound(TYPE_NAME, model.Uid)
+        callback_context["deleting"] = 2
+    if object_uid(kind, namespace, model, session) != model.Uid:
+        progress.status = OperationStatus.SUCCESS
+        return progress
+    # finalizers are still running, back off until the object is gone
+    progress.callbackDelaySeconds = callback_context["deleting"]
+    callback_context["deleting"] = min(callback_context["deleting"] * 2, 60)
+    progress.callbackContext = callback_context
+    LOG.debug(f"waiting for deletion: {progress.__dict__}")
     return progress
 
 
 @resource.handler(Action.READ)
+@profile_handler
 def read_handler(
     session: Optional[SessionProxy],
     request: ResourceHandlerRequest,
@@ -165,7 +256,7 @@ def read_handler(
 ) -> ProgressEvent:
     model = request.desiredResourceState
     if not proxy_needed(model.ClusterName, session):
-        create_kubeconfig(model.ClusterName)
+        create_kubeconfig(model.ClusterName, session)
     if not get_model(model, session):
         raise exceptions.NotFound(TYPE_NAME, model.Uid)
     return ProgressEvent(status=OperationStatus.SUCCESS, resourceModel=model,)
@@ -182,20 +273,22 @@ def list_handler(
 
 def s3_get(url, s3_client):
     try:
-        return (
-            s3_client.get_object(
-                Bucket=url.split("/")[2], Key="/".join(url.split("/")[3:])
-            )["Body"]
-            .read()
-            .decode("utf8")
-        )
+        with timed("s3", url):
+            return (
+                s3_client.get_object(
+                    Bucket=url.split("/")[2], Key="/".join(url.split("/")[3:])
+                )["Body"]
+                .read()
+                .decode("utf8")
+            )
     except Exception as e:
         raise RuntimeError(f"Failed to fetch CustomValueYaml {url} from S3. {e}")
 
 
 def http_get(url):
     try:
-        response = requests.get(url)
+        with timed("http", url):
+            response = requests.get(url)
     except requests.exceptions.RequestException as e:
         raise RuntimeError(f"Failed to fetch CustomValueYaml url {url}: {e}")
     if response.status_code != 200:
@@ -206,22 +299,33 @@ def http_get(url):
     return response.text
 
 
-def run_command(command, cluster_name, session):
+def run_command(command, cluster_name, session, manifest_file="/tmp/manifest.json"):
     if cluster_name and session:
         if proxy_needed(cluster_name, session):
             put_function(session, cluster_name)
-            with open("/tmp/manifest.json", "r") as fh:
-                resp = proxy_call(cluster_name, fh.read(), command, session)
+            manifest = None
+            if os.path.exists(manifest_file):
+                with open(manifest_file, "r") as fh:
+                    manifest = fh.read()
+            resp = proxy_call(cluster_name, manifest, command, session, manifest_file)
             LOG.info(resp)
             return resp
     retries = 0
+    refreshed = False
     while True:
         try:
             try:
                 LOG.debug("executing command: %s" % command)
-                output = subprocess.check_output(
-                    shlex.split(command), stderr=subprocess.STDOUT
-                ).decode("utf-8")
+                args = shlex.split(command)
+                if args[0] == "kubectl":
+                    refresh_kubeconfig()
+                    args[1:1] = kubectl_cache_args()
+                with timed("subprocess", command):
+                    output = throttle.call(
+                        kubeconfig_cluster,
+                        args,
+                        lambda: subprocess.check_output(args, stderr=subprocess.STDOUT),
+                    ).decode("utf-8")
                 LOG.debug(output)
             except subprocess.CalledProcessError as exc:
                 LOG.error(
@@ -231,23 +335,115 @@ def run_command(command, cluster_name, session):
                 raise Exception(exc.output.decode("utf-8"))
             return output
         except Exception as e:
-            if "Unable to connect to the server" not in str(e) or retries >= 5:
+            if not refreshed and kube_cache_dir and STALE_DISCOVERY.search(str(e)):
+                # the kind or version may be missing from a cache taken before it existed
+                LOG.debug("{}, retrying with fresh discovery".format(e))
+                shutil.rmtree(kube_cache_dir, ignore_errors=True)
+                refreshed = True
+                continue
+            if retries >= 5 or (
+                "Unable to connect to the server" not in str(e)
+                and not throttle.THROTTLED.search(str(e))
+            ):
                 raise
-            LOG.debug("{}, retrying in 5 seconds".format(e))
-            sleep(5)
+            delay = throttle.backoff(retries, base=2)
+            LOG.debug("{}, retrying in {:.1f} seconds".format(e, delay))
+            sleep(delay)
             retries += 1
 
 
-def create_kubeconfig(cluster_name):
-    os.environ["PATH"] = f"/var/task/bin:{os.environ['PATH']}"
-    os.environ["PYTHONPATH"] = f"/var/task:{os.environ.get('PYTHONPATH', '')}"
+def run_command_async(command, cluster_name, session, callback_context):
+    # Returns the command output, or None while a proxied command is still running. The
+    # proxy operation is tracked in the callback context across handler invocations.
+    if not proxy_needed(cluster_name, session):
+        return run_command(command, None, None)
+    if "operation" not in callback_context:
+        with open("/tmp/manifest.json", "r") as fh:
+            manifest = fh.read()
+        if len(manifest) > ASYNC_PAYLOAD_LIMIT:
+            return run_command(command, cluster_name, session)
+        put_function(session, cluster_name)
+        callback_context["operation"] = proxy_call_async(
+            cluster_name, manifest, command, session
+        )
+        callback_context["operation_started"] = time()
+        return None
+    result = get_proxy_result(cluster_name, callback_context["operation"], session)
+    if result is None:
+        if time() - callback_context["operation_started"] > ASYNC_TIMEOUT:
+            delete_proxy_result(cluster_name, callback_context["operation"], session)
+            raise Exception(
+                f"timed out waiting for proxy operation {callback_context['operation']}"
+            )
+        return None
+    del callback_context["operation"]
+    del callback_context["operation_started"]
+    resp = check_proxy_response(result)
+    LOG.info(resp)
+    return resp
+
+
+def create_kubeconfig(cluster_name, session):
+    # The kubeconfig holds a token generated from the session's credentials, so kubectl
+    # runs without an exec credential plugin and works wherever the session does.
+    global kubeconfig_cluster, kubeconfig_expires, kubeconfig_session, kube_cache_dir
+    if (
+        kubeconfig_cluster == cluster_name
+        and os.path.exists("/tmp/kube.config")
+        and time() < kubeconfig_expires
+    ):
+        kubeconfig_session = session
+        return
+    # /opt holds the dependency layer when running as the proxy function
+    os.environ["PATH"] = f"/var/task/bin:/opt/bin:{os.environ['PATH']}"
     os.environ["KUBECONFIG"] = "/tmp/kube.config"
-    run_command(
-        f"aws eks update-kubeconfig --name {cluster_name} --alias {cluster_name} --kubeconfig /tmp/kube.config",
-        None,
-        None,
+    config = auth.kubeconfig(
+        describe_cluster(session, cluster_name), auth.eks_token(session, cluster_name)
     )
-    run_command(f"kubectl config use-context {cluster_name}", None, None)
+    with open("/tmp/kube.config", "w") as fh:
+        json.dump(config, fh)
+    # re-read along with the token so that changed limits apply within TOKEN_TTL
+    configure_throttle(session, cluster_name)
+    kubeconfig_expires = time() + auth.TOKEN_TTL
+    kubeconfig_session = session
+    if kubeconfig_cluster != cluster_name:
+        kube_cache_dir = None
+        kubeconfig_cluster = cluster_name
+        kube_cache_dir = kube_cache_path(cluster_name)
+
+
+def refresh_kubeconfig():
+    # replaces the token before it expires in long running proxy invocations
+    if kubeconfig_cluster and time() >= kubeconfig_expires:
+        create_kubeconfig(kubeconfig_cluster, kubeconfig_session)
+
+
+def kube_cache_path(cluster_name):
+    try:
+        version = json.loads(run_command("kubectl get --raw /version", None, None))[
+            "gitVersion"
+        ]
+    except Exception as e:
+        LOG.warning(f"not caching discovery, failed to get server version: {e}")
+        return None
+    return os.path.join(KUBE_CACHE_ROOT, cluster_name, re.sub(r"[^\w.-]", "_", version))
+
+
+def kubectl_cache_args():
+    # the cache is started over once it is older than KUBE_CACHE_TTL so that CRDs and
+    # API versions added since are discovered. Some kubectl versions only move the HTTP
+    # cache with --cache-dir and keep discovery under $HOME/.kube, HOME is unset or
+    # read-only in Lambda so it is pointed at the cluster's cache directory as well.
+    os.environ["HOME"] = kube_cache_dir or KUBE_CACHE_ROOT
+    if not kube_cache_dir:
+        return []
+    stamp = os.path.join(kube_cache_dir, ".created")
+    if os.path.exists(stamp) and time() - os.path.getmtime(stamp) > KUBE_CACHE_TTL:
+        shutil.rmtree(kube_cache_dir, ignore_errors=True)
+    if not os.path.exists(stamp):
+        os.makedirs(kube_cache_dir, exist_ok=True)
+        open(stamp, "w").close()
+    return [f"--cache-dir={kube_cache_dir}"]
 
 
 def json_serial(o):
@@ -264,8 +460,22 @@ def write_manifest(manifest, path):
     f.close()
 
 
-def generate_name(model, physical_resource_id, stack_name):
-    manifest = yaml.safe_load(model.Manifest)
+def load_manifest(text):
+    documents = [d for d in yaml.safe_load_all(text) if d]
+    if len(documents) == 1:
+        return documents[0]
+    return {"apiVersion": "v1", "kind": "List", "items": documents}
+
+
+def primary_document(manifest):
+    # the first object of a multi-document manifest is the one tracked by the model
+    if manifest.get("kind") == "List" and manifest.get("items"):
+        return manifest["items"][0]
+    return manifest
+
+
+def generate_name(manifest, physical_resource_id, stack_name):
+    manifest = primary_document(manifest)
     if "metadata" in manifest.keys():
         if (
             "name" not in manifest["metadata"].keys()
@@ -275,11 +485,10 @@ def generate_name(model, physical_resource_id, stack_name):
                 manifest["metadata"]["name"] = physical_resource_id.split("/")[-1]
             else:
                 manifest["metadata"]["generateName"] = "cfn-%s-" % stack_name.lower()
-    return manifest
 
 
 def build_model(kube_response, model):
-    for key in ["uid", "selfLink", "resourceVersion", "namespace", "name"]:
+    for key in MODEL_METADATA:
         if key in kube_response["metadata"].keys():
             setattr(
                 model, key[0].capitalize() + key[1:], kube_response["metadata"][key]
@@ -293,27 +502,75 @@ def handler_init(model, session, stack_name, token):
 
     physical_resource_id = None
     manifest_file = "/tmp/manifest.json"
-    if not proxy_needed(model.ClusterName, session):
-        create_kubeconfig(model.ClusterName)
-    s3_client = session.client("s3")
     if (not model.Manifest and not model.Url) or (model.Manifest and model.Url):
         raise Exception("Either Manifest or Url must be specified.")
+    s3_client = session.client("s3")
+    steps = {
+        "cluster": lambda cancelled: prepare_cluster(
+            model.ClusterName, session, cancelled
+        )
+    }
+    if model.Url:
+        steps["manifest"] = lambda _cancelled: fetch_manifest(model.Url, s3_client)
+    results = preflight(steps)
     if model.Manifest:
-        if model.SelfLink:
-            physical_resource_id = model.SelfLink
-        manifest = generate_name(model, physical_resource_id, stack_name)
+        # the name of an existing object, selfLink is no longer set from Kubernetes 1.20
+        if model.Name:
+            physical_resource_id = model.Name
+        manifest = load_manifest(model.Manifest)
+        generate_name(manifest, physical_resource_id, stack_name)
     else:
-        if re.match(s3_scheme, model.Url):
-            response = s3_get(model.Url, s3_client)
-        else:
-            response = http_get(model.Url)
-        manifest = yaml.safe_load(response)
+        manifest = load_manifest(results["manifest"])
     add_idempotency_token(manifest, token)
     write_manifest(manifest, manifest_file)
     return physical_resource_id, manifest_file, manifest
 
 
+def preflight(steps):
+    # Runs independent setup steps concurrently and returns their results by name. The
+    # event passed to each step is set as soon as any step fails, steps check it before
+    # starting expensive work. All failures are reported together.
+    cancelled = threading.Event()
+
+    def run(step):
+        try:
+            return step(cancelled)
+        except Exception:
+            cancelled.set()
+            raise
+
+    with ThreadPoolExecutor(max_workers=len(steps)) as executor:
+        futures = {name: executor.submit(run, step) for name, step in steps.items()}
+    failed = {n: f.exception() for n, f in futures.items() if f.exception()}
+    if len(failed) == 1:
+        raise next(iter(failed.values()))
+    if failed:
+        raise Exception("; ".join(f"{n}: {e}" for n, e in failed.items()))
+    return {name: future.result() for name, future in futures.items()}
+
+
+def prepare_cluster(cluster_name, session, cancelled):
+    # either deploys (or checks) the proxy function or sets up direct cluster access
+    needed = proxy_needed(cluster_name, session)
+    if cancelled.is_set():
+        return
+    if needed:
+        put_function(session, cluster_name)
+    else:
+        create_kubeconfig(cluster_name, session)
+
+
+def fetch_manifest(url, s3_client):
+    if re.match(s3_scheme, url):
+        return s3_get(url, s3_client)
+    return http_get(url)
+
+
 def add_idempotency_token(manifest, token):
+    if manifest.get("kind") == "List":
+        for item in manifest.get("items", []):
+            add_idempotency_token(item, token)
+        return
     if "metadata" not in manifest:
         manifest["metadata"] = {}
     if not manifest.get("metadata", {}).get("annotations"):
@@ -321,6 +578,246 @@ def add_idempotency_token(manifest, token):
     manifest["metadata"]["annotations"]["cfn-client-token"] = token
 
 
+def create_waves(documents, model, session, callback_context):
+    # Creates a multi-document manifest in dependency order, one wave per handler
+    # invocation, and records each object's outcome in the callback context. Returns
+    # the output for the primary (first) object once every wave is done, None while
+    # waves remain. CloudFormation doesn't delete what a failed create leaves behind, so
+    # if a wave fails the objects created so far are deleted again.
+    waves = plan_waves(documents, model.Namespace)
+    outcomes = callback_context.setdefault("outcomes", [None] * len(documents))
+    current = callback_context.setdefault("wave", 0)
+    wave = waves[current]
+    for i, outcome in write_wave(wave, documents, model, session, "create").items():
+        outcomes[i] = outcome
+    try:
+        failed = [outcomes[i] for i in wave if outcomes[i]["status"] == "FAILED"]
+        if failed:
+            raise Exception("; ".join(f"{o['object']}: {o['error']}" for o in failed))
+        # an existing primary object fails the create, there's no point in going on
+        if 0 in wave and outcomes[0]["status"] == "EXISTS":
+            raise Exception(outcomes[0]["error"])
+        establish_crds(wave, documents, model, session)
+    except Exception:
+        roll_back(waves[: current + 1], documents, outcomes, model, session)
+        raise
+    callback_context["wave"] = current + 1
+    if current + 1 < len(waves):
+        return None
+    return outcomes[0]["output"]
+
+
+def apply_waves(documents, model, session):
+    # Applies a multi-document manifest in dependency order, each object in its own
+    # namespace. Returns the output for the primary (first) object.
+    outcomes = {}
+    for wave in plan_waves(documents, model.Namespace):
+        outcomes.update(write_wave(wave, documents, model, session, "apply"))
+        failed = [outcomes[i] for i in wave if outcomes[i]["status"] == "FAILED"]
+        if failed:
+            raise Exception("; ".join(f"{o['object']}: {o['error']}" for o in failed))
+        establish_crds(wave, documents, model, session)
+    return outcomes[0]["output"]
+
+
+def write_wave(wave, documents, model, session, verb):
+    # objects in the same wave are independent and written concurrently
+    workers = min(MAX_WAVE_WORKERS, len(wave))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            lambda i: write_document(i, documents[i], model, session, verb), wave
+        )
+        outcomes = dict(zip(wave, results))
+    for i in wave:
+        LOG.info(f"{outcomes[i]['object']}: {outcomes[i]['status']}")
+    return outcomes
+
+
+def establish_crds(wave, documents, model, session):
+    # later waves may hold objects of the kinds the wave's CRDs define
+    crds = [
+        documents[i]["metadata"]["name"]
+        for i in wave
+        if documents[i].get("kind") == "CustomResourceDefinition"
+    ]
+    if crds:
+        run_command(
+            "kubectl wait --for condition=established --timeout=60s %s"
+            % " ".join(f"crd/{name}" for name in crds),
+            model.ClusterName,
+            session,
+        )
+
+
+def write_document(index, document, model, session, verb):
+    namespace = object_namespace(document, model.Namespace)
+    outcome = {"object": describe(document, namespace), "status": "CREATED"}
+    manifest_file = f"/tmp/manifest-{index}.json"
+    write_manifest(document, manifest_file)
+    if verb == "create":
+        command = f"kubectl create --save-config -o json -f {manifest_file}"
+    else:
+        command = f"kubectl apply -o json -f {manifest_file}"
+        outcome["status"] = "APPLIED"
+    if namespace:
+        command += f" -n {namespace}"
+    try:
+        # only the metadata is kept, the outcome ends up in the callback context
+        outcome["output"] = model_output(
+            run_command(command, model.ClusterName, session, manifest_file)
+        )
+    except Exception as e:
+        outcome["error"] = str(e)
+        if "Error from server (AlreadyExists)" in str(e):
+            outcome["status"] = "EXISTS"
+        else:
+            outcome["status"] = "FAILED"
+    else:
+        # the name given to a generateName object, to roll it back by
+        outcome["name"] = json.loads(outcome["output"])["metadata"].get("name")
+    return outcome
+
+
+def roll_back(waves, documents, outcomes, model, session):
+    for wave in reversed(waves):
+        for i in wave:
+            if outcomes[i] and outcomes[i]["status"] == "CREATED":
+                try:
+                    delete_document(
+                        i, documents[i], model, session, name=outcomes[i].get("name")
+                    )
+                    outcomes[i]["status"] = "ROLLED_BACK"
+                except Exception as e:
+                    LOG.error(f"failed to roll back {outcomes[i]['object']}: {e}")
+                LOG.info(f"{outcomes[i]['object']}: {outcomes[i]['status']}")
+
+
+def delete_documents(documents, model, session, token):
+    # reverse dependency order, custom resources go before their CRDs and namespaces
+    # are deleted last
+    policy = model.PropagationPolicy or "Background"
+    for wave in reversed(plan_waves(documents, model.Namespace)):
+        for i in wave:
+            if documents[i].get("metadata", {}).get("name"):
+                delete_document(i, documents[i], model, session, policy)
+                continue
+            # objects created from a generateName are found by the create's token
+            for name in created_names(documents[i], token, model, session):
+                delete_document(i, documents[i], model, session, policy, name)
+
+
+def created_names(document, token, model, session):
+    namespace = object_namespace(document, model.Namespace)
+    kind = document["kind"]
+    if api_group(document):
+        kind += f".{api_group(document)}"
+    command = f"kubectl get {kind} -o json"
+    if namespace:
+        command += f" -n {namespace}"
+    try:
+        items = json.loads(run_command(command, model.ClusterName, session))["items"]
+    except Exception as e:
+        # the CRD of a custom resource may already be gone
+        if "the server doesn't have a resource type" not in str(e):
+            raise
+        return []
+    return [
+        item["metadata"]["name"]
+        for item in items
+        if item["metadata"].get("annotations", {}).get("cfn-client-token") == token
+    ]
+
+
+def delete_document(index, document, model, session, policy="Background", name=None):
+    namespace = object_namespace(document, model.Namespace)
+    if name:
+        metadata = dict(document.get("metadata", {}), name=name)
+        metadata.pop("generateName", None)
+        document = dict(document, metadata=metadata)
+    manifest_file = f"/tmp/manifest-{index}.json"
+    write_manifest(document, manifest_file)
+    command = (
+        f"kubectl delete --wait=false --ignore-not-found "
+        f"--cascade={policy.lower()} -f {manifest_file}"
+    )
+    if namespace:
+        command += f" -n {namespace}"
+    run_command(command, model.ClusterName, session, manifest_file)
+
+
+def object_uid(kind, namespace, model, session):
+    try:
+        return run_command(
+            f"kubectl get {kind}/{model.Name} -n {namespace} "
+            "-o jsonpath={.metadata.uid}",
+            model.ClusterName,
+            session,
+        )
+    except Exception as e:
+        if "Error from server (NotFound)" not in str(e):
+            raise
+    return None
+
+
+def delete_object(kind, namespace, model, session):
+    # Deletes the object identified by the model without waiting for finalizers,
+    # returns False if it no longer exists or has been replaced by a different object.
+    # The UID is sent as a precondition so a replacement is never deleted by name.
+    try:
+        document = json.loads(
+            run_command(
+                f"kubectl get {kind}/{model.Name} -n {namespace} -o json",
+                model.ClusterName,
+                session,
+            )
+        )
+    except Exception as e:
+        if "Error from server (NotFound)" in str(e):
+            return False
+        raise
+    if document["metadata"]["uid"] != model.Uid:
+        return False
+    manifest_file = "/tmp/delete-options.json"
+    write_manifest(
+        {
+            "apiVersion": "v1",
+            "kind": "DeleteOptions",
+            "propagationPolicy": model.PropagationPolicy or "Background",
+            "preconditions": {"uid": model.Uid},
+        },
+        manifest_file,
+    )
+    try:
+        run_command(
+            "kubectl delete --raw %s -f %s"
+            % (object_path(document, namespace, model, session), manifest_file),
+            model.ClusterName,
+            session,
+            manifest_file,
+        )
+    except Exception as e:
+        if "Error from server (NotFound)" in str(e) or "Precondition failed" in str(e):
+            return False
+        raise
+    return True
+
+
+def object_path(document, namespace, model, session):
+    # selfLink is no longer populated from Kubernetes 1.20, the API path is built from
+    # the discovery document of the object's group version
+    api_version = document["apiVersion"]
+    prefix = f"/apis/{api_version}" if "/" in api_version else f"/api/{api_version}"
+    discovery = json.loads(
+        run_command(f"kubectl get --raw {prefix}", model.ClusterName, session)
+    )
+    for resource in discovery["resources"]:
+        if resource["kind"] == document["kind"] and "/" not in resource["name"]:
+            if resource["namespaced"]:
+                prefix += f"/namespaces/{namespace}"
+            return f"{prefix}/{resource['name']}/{document['metadata']['name']}"
+    raise Exception(f"{document['kind']} is not served by {api_version}")
+
+
 def stabilize_job(namespace, name, cluster_name, session):
     response = json.loads(
         run_command(
@@ -338,22 +835,74 @@ def stabilize_job(namespace, name, cluster_name, session):
     return False
 
 
+@record_duration
+@profile_proxy
 def proxy_wrap(event, _context):
     LOG.debug(json.dumps(event))
+    if event.get("warmup"):
+        LOG.debug("keep-warm ping")
+        return ""
     if event.get("manifest"):
-        write_manifest(event["manifest"], "/tmp/manifest.json")
-    create_kubeconfig(event["cluster_name"])
-    return run_command(event["command"], event["cluster_name"], boto3.session.Session())
+        write_manifest(
+            event["manifest"], event.get("manifest_file", "/tmp/manifest.json")
+        )
+    if not event.get("operation_id"):
+        create_kubeconfig(event["cluster_name"], proxy_session)
+        return run_command(event["command"], event["cluster_name"], proxy_session)
+    try:
+        create_kubeconfig(event["cluster_name"], proxy_session)
+        result = model_output(
+            run_command(event["command"], event["cluster_name"], proxy_session)
+        )
+    except Exception as e:
+        LOG.error(traceback.format_exc())
+        result = {"errorType": type(e).__name__, "errorMessage": str(e)}
+    try:
+        put_proxy_result(
+            event["cluster_name"], event["operation_id"], result, proxy_session
+        )
+    except Exception as e:
+        # a small error result at least lets the handler fail now rather than wait out
+        # ASYNC_TIMEOUT, the command isn't run again either way
+        LOG.error(traceback.format_exc())
+        put_proxy_result(
+            event["cluster_name"],
+            event["operation_id"],
+            {"errorType": "ResultNotStored", "errorMessage": str(e)},
+            proxy_session,
+        )
+    return result
+
+
+def model_output(output):
+    # The result of an asynchronous command is passed back through an SSM parameter,
+    # which holds at most 8KB. Objects are cut down to what build_model reads, the
+    # output of create --save-config holds the whole manifest twice.
+    try:
+        kube_response = json.loads(output)
+    except ValueError:
+        return output
+    if not isinstance(kube_response, dict) or "metadata" not in kube_response:
+        return output
+    metadata = kube_response["metadata"]
+    return json.dumps(
+        {"metadata": {key: metadata[key] for key in MODEL_METADATA if key in metadata}}
+    )
 
 
-def encode_id(client_token, cluster_name, namespace, kind):
-    return base64.b64encode(
-        f"{client_token}|{cluster_name}|{namespace}|{kind}".encode("utf-8")
-    ).decode("utf-8")
+def encode_id(client_token, cluster_name, namespace, kind, bundle=False):
+    cfn_id = f"{client_token}|{cluster_name}|{namespace}|{kind}"
+    if bundle:
+        cfn_id += "|List"
+    return base64.b64encode(cfn_id.encode("utf-8")).decode("utf-8")
 
 
 def decode_id(encoded_id):
-    return tuple(base64.b64decode(encoded_id).decode("utf-8").split("|"))
+    return tuple(base64.b64decode(encoded_id).decode("utf-8").split("|")[:4])
+
+
+def is_bundle(encoded_id):
+    return base64.b64decode(encoded_id).decode("utf-8").split("|")[4:] == ["List"]
 
 
 def get_model(model, session):
@@ -366,3 +915,21 @@ def get_model(model, session):
             build_model(i, model)
             return model
     return None
+
+
+def proxy_init():
+    # The proxy function is deployed with PROXY_CLUSTER_NAME set, resolve credentials
+    # and build the kubeconfig during init rather than on the first proxied command.
+    cluster_name = os.environ.get("PROXY_CLUSTER_NAME")
+    if not cluster_name:
+        return None
+    session = boto3.session.Session()
+    session.get_credentials()
+    try:
+        create_kubeconfig(cluster_name, session)
+    except Exception as e:
+        LOG.warning(f"eager kubeconfig init failed, will retry on invoke: {e}")
+    return session
+
+
+proxy_session = proxy_init() or boto3.session.Session()
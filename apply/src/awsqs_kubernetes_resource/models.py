@@ -43,6 +43,7 @@ class ResourceModel(BaseModel):
     Namespace: Optional[str]
     Manifest: Optional[str]
     Url: Optional[str]
+    PropagationPolicy: Optional[str]
     Name: Optional[str]
     ResourceVersion: Optional[str]
     SelfLink: Optional[str]
@@ -63,6 +64,7 @@ class ResourceModel(BaseModel):
             Namespace=json_data.get("Namespace"),
             Manifest=json_data.get("Manifest"),
             Url=json_data.get("Url"),
+            PropagationPolicy=json_data.get("PropagationPolicy"),
             Name=json_data.get("Name"),
             ResourceVersion=json_data.get("ResourceVersion"),
             SelfLink=json_data.get("SelfLink"),
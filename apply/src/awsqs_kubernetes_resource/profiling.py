@@ -0,0 +1,139 @@
+import cProfile
+import functools
+import io
+import json
+import logging
+import marshal
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from random import choice
+from string import ascii_lowercase
+
+import boto3
+
+LOG = logging.getLogger(__name__)
+
+# Handler invocations are profiled while the cluster's proxy config has "Profile": true,
+# and the proxy invocations they make are profiled along with them. "ProfileS3" is an
+# s3://bucket/prefix to upload pstats dumps to, otherwise a summary is logged. Checking
+# the switch doesn't read the config: an execution environment picks it up whenever it
+# reads the config anyway (see configure), so it takes effect from the invocations after
+# that. An operation whose first invocation is profiled carries the switch in its
+# callback context, a "profile" key there profiles an invocation whatever the config.
+
+# timings of the invocation currently being profiled, None when profiling is off, and
+# where its profile goes, passed on to the proxy
+active = None
+target = None
+# profile targets, "" to log, of the clusters whose config last read had "Profile": true
+switches = {}
+
+
+def configure(cluster_name, settings):
+    if settings.get("Profile"):
+        switches[cluster_name] = settings.get("ProfileS3") or ""
+    else:
+        switches.pop(cluster_name, None)
+
+
+@contextmanager
+def timed(category, label):
+    if active is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        active.append((category, label, time.perf_counter() - start))
+
+
+def profile_handler(func):
+    @functools.wraps(func)
+    def wrapper(session, request, callback_context):
+        s3_target = callback_context.get("profile")
+        if s3_target is None:
+            model = request.desiredResourceState
+            s3_target = switches.get(getattr(model, "ClusterName", None))
+        if s3_target is None:
+            return func(session, request, callback_context)
+        progress = run_profiled(
+            func.__name__, session, s3_target, func, session, request, callback_context
+        )
+        if getattr(progress, "callbackContext", None) is not None:
+            progress.callbackContext["profile"] = s3_target
+        return progress
+
+    return wrapper
+
+
+def profile_proxy(func):
+    @functools.wraps(func)
+    def wrapper(event, context):
+        options = event.get("profile")
+        if not options:
+            return func(event, context)
+        return run_profiled(
+            func.__name__, None, options.get("s3"), func, event, context
+        )
+
+    return wrapper
+
+
+def run_profiled(name, session, s3_target, func, *args):
+    global active, target
+    active = []
+    target = s3_target
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        return profiler.runcall(func, *args)
+    finally:
+        duration = time.perf_counter() - start
+        _current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        timings, active, target = active, None, None
+        try:
+            report(name, session, s3_target, profiler, duration, peak, timings)
+        except Exception as e:
+            LOG.warning(f"failed to write profile for {name}: {e}")
+
+
+def report(name, session, s3_target, profiler, duration, peak, timings):
+    calls = {}
+    for category, _label, seconds in timings:
+        count, total, slowest = calls.get(category, (0, 0.0, 0.0))
+        calls[category] = (count + 1, total + seconds, max(slowest, seconds))
+    summary = {
+        "name": name,
+        "duration": round(duration, 3),
+        "peak_memory_bytes": peak,
+        "calls": {
+            c: {"count": n, "total": round(t, 3), "max": round(m, 3)}
+            for c, (n, t, m) in calls.items()
+        },
+        "slowest_calls": [
+            [c, label, round(s, 3)]
+            for c, label, s in sorted(timings, key=lambda t: -t[2])[:5]
+        ],
+    }
+    if not s3_target:
+        stats = io.StringIO()
+        pstats.Stats(profiler, stream=stats).sort_stats("cumulative").print_stats(15)
+        LOG.info(f"profile: {json.dumps(summary)}\n{stats.getvalue()}")
+        return
+    bucket, _, prefix = s3_target[len("s3://") :].partition("/")
+    suffix = "".join(choice(ascii_lowercase) for _ in range(6))
+    key = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{name}-{suffix}"
+    if prefix.strip("/"):
+        key = f"{prefix.strip('/')}/{key}"
+    s3 = (session or boto3.session.Session()).client("s3")
+    profiler.create_stats()
+    # same format as pstats.Stats.dump_stats, loadable with pstats.Stats(path)
+    s3.put_object(Bucket=bucket, Key=f"{key}.prof", Body=marshal.dumps(profiler.stats))
+    s3.put_object(Bucket=bucket, Key=f"{key}.json", Body=json.dumps(summary))
+    LOG.info(f"profile written to s3://{bucket}/{key}.prof: {json.dumps(summary)}")
@@ -0,0 +1,106 @@
+import logging
+import re
+import threading
+import time
+from concurrent.futures import Future
+from random import uniform
+
+LOG = logging.getLogger(__name__)
+
+# Client side limit on kubectl commands sent to a cluster, per execution environment.
+# Configured per cluster from the proxy config (see vpc.py), a QPS of 0 turns the limit
+# off. Nothing here is shared between execution environments: the proxy's reserved
+# concurrency, when set, bounds how many proxy environments send at once, handlers that
+# reach the cluster directly aren't bounded.
+DEFAULT_QPS = 10.0
+DEFAULT_BURST = 20
+
+# apiserver asking the client to back off (HTTP 429)
+THROTTLED = re.compile(r"TooManyRequests|too many requests")
+
+limits = {}
+buckets = {}
+in_flight = {}
+lock = threading.Lock()
+
+
+class TokenBucket:
+    def __init__(self, qps, burst):
+        self.qps = qps
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.qps
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.qps
+            time.sleep(wait)
+
+
+def configure(cluster_name, qps, burst):
+    with lock:
+        limits[cluster_name] = (qps, burst)
+
+
+def bucket(cluster_name):
+    qps, burst = limits.get(cluster_name, (DEFAULT_QPS, DEFAULT_BURST))
+    if qps <= 0:
+        return None
+    with lock:
+        current = buckets.get(cluster_name)
+        if current is None or (current.qps, current.burst) != (qps, burst):
+            current = buckets[cluster_name] = TokenBucket(qps, burst)
+        return current
+
+
+def verb(args):
+    return next((a for a in args[1:] if not a.startswith("-")), None)
+
+
+def call(cluster_name, args, func):
+    # Runs func, a kubectl invocation with the given arguments, once the cluster's
+    # bucket allows it. Concurrent identical reads in this execution environment share
+    # the result of the first one.
+    if args[0] != "kubectl" or verb(args) == "config":
+        return func()
+    key = (cluster_name, tuple(args)) if verb(args) == "get" else None
+    if key is not None:
+        with lock:
+            future = in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = in_flight[key] = Future()
+        if not leader:
+            LOG.debug(f"coalescing with in-flight {' '.join(args)}")
+            return future.result()
+    try:
+        limit = bucket(cluster_name)
+        if limit:
+            limit.acquire()
+        result = func()
+    except BaseException as e:
+        if key is not None:
+            future.set_exception(e)
+        raise
+    finally:
+        if key is not None:
+            with lock:
+                in_flight.pop(key, None)
+    if key is not None:
+        future.set_result(result)
+    return result
+
+
+def backoff(attempt, base=1.0, cap=30.0):
+    # full jitter, so that clients throttled together do not retry together
+    return uniform(0, min(cap, base * 2**attempt))
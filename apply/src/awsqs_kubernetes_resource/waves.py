@@ -0,0 +1,153 @@
+import logging
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+LOG = logging.getLogger(__name__)
+
+CLUSTER_SCOPED_KINDS = {
+    "APIService",
+    "CSIDriver",
+    "ClusterRole",
+    "ClusterRoleBinding",
+    "CustomResourceDefinition",
+    "IngressClass",
+    "MutatingWebhookConfiguration",
+    "Namespace",
+    "PersistentVolume",
+    "PodSecurityPolicy",
+    "PriorityClass",
+    "RuntimeClass",
+    "StorageClass",
+    "ValidatingWebhookConfiguration",
+}
+
+WORKLOAD_KINDS = {
+    "CronJob",
+    "DaemonSet",
+    "Deployment",
+    "Job",
+    "Pod",
+    "ReplicaSet",
+    "StatefulSet",
+}
+
+# kinds that an object of the given kind may reference, if present in the same bundle
+# (and in the same namespace, unless either side is cluster scoped)
+KIND_DEPENDENCIES = {
+    "RoleBinding": {"Role", "ClusterRole", "ServiceAccount"},
+    "ClusterRoleBinding": {"ClusterRole", "ServiceAccount"},
+    "PersistentVolumeClaim": {"StorageClass", "PersistentVolume"},
+    "Service": {"ServiceAccount"},
+    "MutatingWebhookConfiguration": {"Service"} | WORKLOAD_KINDS,
+    "ValidatingWebhookConfiguration": {"Service"} | WORKLOAD_KINDS,
+    "APIService": {"Service"} | WORKLOAD_KINDS,
+}
+for _kind in WORKLOAD_KINDS:
+    KIND_DEPENDENCIES[_kind] = {
+        "ConfigMap",
+        "Secret",
+        "ServiceAccount",
+        "PersistentVolumeClaim",
+        "PriorityClass",
+        "Role",
+        "RoleBinding",
+        "ClusterRole",
+        "ClusterRoleBinding",
+    }
+
+
+def api_group(document: Dict[str, Any]) -> str:
+    api_version = document.get("apiVersion", "")
+    return api_version.split("/")[0] if "/" in api_version else ""
+
+
+def crd_index(documents: List[Dict[str, Any]]) -> Dict[Tuple[str, str], int]:
+    index = {}
+    for i, document in enumerate(documents):
+        if document.get("kind") == "CustomResourceDefinition":
+            spec = document.get("spec", {})
+            index[(spec.get("group", ""), spec.get("names", {}).get("kind", ""))] = i
+    return index
+
+
+def object_namespace(
+    document: Dict[str, Any],
+    default_namespace: Optional[str],
+    crd: Optional[Dict[str, Any]] = None,
+) -> Optional[str]:
+    if document.get("kind") in CLUSTER_SCOPED_KINDS or (
+        crd and crd.get("spec", {}).get("scope") == "Cluster"
+    ):
+        return None
+    return document.get("metadata", {}).get("namespace") or default_namespace
+
+
+def describe(document: Dict[str, Any], namespace: Optional[str]) -> str:
+    metadata = document.get("metadata", {})
+    name = metadata.get("name") or metadata.get("generateName", "") + "*"
+    if namespace:
+        return f"{document.get('kind')} {namespace}/{name}"
+    return f"{document.get('kind')} {name}"
+
+
+def dependencies(
+    documents: List[Dict[str, Any]], default_namespace: Optional[str]
+) -> List[Set[int]]:
+    crds = crd_index(documents)
+    defining_crd = [crds.get((api_group(d), d.get("kind", ""))) for d in documents]
+    namespaces = [
+        object_namespace(d, default_namespace, None if c is None else documents[c])
+        for d, c in zip(documents, defining_crd)
+    ]
+    namespace_index = {
+        d.get("metadata", {}).get("name"): i
+        for i, d in enumerate(documents)
+        if d.get("kind") == "Namespace"
+    }
+    deps = []
+    for i, document in enumerate(documents):
+        kind = document.get("kind", "")
+        needs = set()
+        if namespaces[i] in namespace_index:
+            needs.add(namespace_index[namespaces[i]])
+        if defining_crd[i] is not None:
+            needs.add(defining_crd[i])
+        for j, other in enumerate(documents):
+            if other.get("kind") not in KIND_DEPENDENCIES.get(kind, set()):
+                continue
+            if namespaces[i] and namespaces[j] and namespaces[i] != namespaces[j]:
+                continue
+            needs.add(j)
+        needs.discard(i)
+        deps.append(needs)
+    return deps
+
+
+def plan_waves(
+    documents: List[Dict[str, Any]], default_namespace: Optional[str]
+) -> List[List[int]]:
+    # Each object is placed one wave after the latest of its dependencies, objects
+    # within a wave are independent and keep their order from the manifest.
+    deps = dependencies(documents, default_namespace)
+    levels: Dict[int, int] = {}
+
+    def level(i, path):
+        if i in levels:
+            return levels[i]
+        if i in path:
+            raise Exception(
+                "dependency cycle in manifest: "
+                + " -> ".join(describe(documents[j], None) for j in path + [i])
+            )
+        levels[i] = max([level(j, path + [i]) + 1 for j in deps[i]], default=0)
+        return levels[i]
+
+    for i in range(len(documents)):
+        level(i, [])
+    waves: List[List[int]] = [[] for _ in range(max(levels.values(), default=-1) + 1)]
+    for i in range(len(documents)):
+        waves[levels[i]].append(i)
+    LOG.debug(
+        "apply waves: %s"
+        % [[describe(documents[i], None) for i in wave] for wave in waves]
+    )
+    return waves
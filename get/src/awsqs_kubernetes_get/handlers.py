@@ -1,10 +1,13 @@
 import logging
 from typing import Any, MutableMapping, Optional
 import json
+import re
 import subprocess
 import shlex
+import shutil
 import time
 from hashlib import md5
+from urllib.parse import urlencode
 import boto3
 import hashlib
 import os
@@ -19,8 +22,12 @@ from cloudformation_cli_python_lib import (
     exceptions,
 )
 
+from . import auth, jsonpath, throttle
 from .models import ResourceHandlerRequest, ResourceModel
-from .vpc import proxy_needed, proxy_call, put_function
+from .profiling import profile_handler, profile_proxy, timed
+from .vpc import (
+    configure_throttle, describe_cluster, proxy_needed, proxy_call, put_function, record_duration
+)
 
 # Use this logger to forward log messages to CloudWatch Logs.
 LOG = logging.getLogger(__name__)
@@ -31,24 +38,174 @@ LOG.setLevel(logging.INFO)
 resource = Resource(TYPE_NAME, ResourceModel)
 test_entrypoint = resource.test_entrypoint
 
+# cluster whose context is currently active in /tmp/kube.config, kept across warm
+# invocations so that kubeconfig generation only happens once per container, and when
+# the token in it is due to be replaced, along with the session to replace it with
+kubeconfig_cluster = None
+kubeconfig_expires = 0
+kubeconfig_session = None
+
+# kubectl discovery and OpenAPI cache for the active cluster, per server version. Lambda has no persistent
+# ~/.kube/cache, so without it every query starts with a full discovery of the apiserver.
+KUBE_CACHE_ROOT = '/tmp/kube-cache'
+KUBE_CACHE_TTL = 3600
+STALE_DISCOVERY = re.compile(r"the server doesn't have a resource type|no matches for kind")
+kube_cache_dir = None
+
+# Selector queries list objects straight from the apiserver a page at a time, evaluating JsonPath per page so that
+# memory stays flat however many objects match, and fail once the aggregated response outgrows MAX_RESPONSE_BYTES.
+PAGE_SIZE = 250
+MAX_RESPONSE_BYTES = 64 * 1024
+# (cluster, resource type) -> (api path prefix, plural, namespaced)
+api_paths = {}
+
 
-def run_command(command):
+class ResponseTooLarge(Exception):
+    pass
+
+
+def run_command(command, refreshed=False, log_output=True):
+    args = shlex.split(command)
+    if args[0] == 'kubectl':
+        refresh_kubeconfig()
+        args[1:1] = kubectl_cache_args()
     try:
         LOG.info("executing command: %s" % command)
-        output = subprocess.check_output(shlex.split(command), stderr=subprocess.STDOUT).decode("utf-8")
-        LOG.info(output)
+        with timed('subprocess', command):
+            output = throttle.call(
+                kubeconfig_cluster, args, lambda: subprocess.check_output(args, stderr=subprocess.STDOUT)
+            ).decode("utf-8")
+        if log_output:
+            LOG.info(output)
     except subprocess.CalledProcessError as exc:
         LOG.error("Command failed with exit code %s, stderr: %s" % (exc.returncode, exc.output.decode("utf-8")))
+        if not refreshed and kube_cache_dir and STALE_DISCOVERY.search(exc.output.decode("utf-8")):
+            # the kind or version may be missing from a cache taken before it existed
+            LOG.info('retrying with fresh discovery')
+            shutil.rmtree(kube_cache_dir, ignore_errors=True)
+            return run_command(command, refreshed=True, log_output=log_output)
         raise Exception(exc.output.decode("utf-8"))
     return output
 
 
-def create_kubeconfig(cluster_name):
-    os.environ['PATH'] = f"/var/task/bin:{os.environ['PATH']}"
-    os.environ['PYTHONPATH'] = f"/var/task:{os.environ.get('PYTHONPATH', '')}"
+def create_kubeconfig(cluster_name, session):
+    # The kubeconfig holds a token generated from the session's credentials, so kubectl runs without an exec
+    # credential plugin and works wherever the session does.
+    global kubeconfig_cluster, kubeconfig_expires, kubeconfig_session, kube_cache_dir
+    if kubeconfig_cluster == cluster_name and os.path.exists('/tmp/kube.config') and time.time() < kubeconfig_expires:
+        kubeconfig_session = session
+        return
+    # /opt holds the dependency layer when running as the proxy function
+    os.environ['PATH'] = f"/var/task/bin:/opt/bin:{os.environ['PATH']}"
     os.environ['KUBECONFIG'] = "/tmp/kube.config"
-    run_command(f"aws eks update-kubeconfig --name {cluster_name} --alias {cluster_name} --kubeconfig /tmp/kube.config")
-    run_command(f"kubectl config use-context {cluster_name}")
+    config = auth.kubeconfig(describe_cluster(session, cluster_name), auth.eks_token(session, cluster_name))
+    with open('/tmp/kube.config', 'w') as fh:
+        json.dump(config, fh)
+    # re-read along with the token so that changed limits apply within TOKEN_TTL
+    configure_throttle(session, cluster_name)
+    kubeconfig_expires = time.time() + auth.TOKEN_TTL
+    kubeconfig_session = session
+    if kubeconfig_cluster != cluster_name:
+        kube_cache_dir = None
+        kubeconfig_cluster = cluster_name
+        kube_cache_dir = kube_cache_path(cluster_name)
+
+
+def refresh_kubeconfig():
+    # replaces the token before it expires in long running proxy invocations
+    if kubeconfig_cluster and time.time() >= kubeconfig_expires:
+        create_kubeconfig(kubeconfig_cluster, kubeconfig_session)
+
+
+def kube_cache_path(cluster_name):
+    try:
+        version = json.loads(run_command('kubectl get --raw /version'))['gitVersion']
+    except Exception as e:
+        LOG.warning(f'not caching discovery, failed to get server version: {e}')
+        return None
+    return os.path.join(KUBE_CACHE_ROOT, cluster_name, re.sub(r'[^\w.-]', '_', version))
+
+
+def kubectl_cache_args():
+    # the cache is started over once it is older than KUBE_CACHE_TTL so that CRDs and API versions added since are
+    # discovered. Some kubectl versions only move the HTTP cache with --cache-dir and keep discovery under
+    # $HOME/.kube, HOME is unset or read-only in Lambda so it is pointed at the cluster's cache directory as well.
+    os.environ['HOME'] = kube_cache_dir or KUBE_CACHE_ROOT
+    if not kube_cache_dir:
+        return []
+    stamp = os.path.join(kube_cache_dir, '.created')
+    if os.path.exists(stamp) and time.time() - os.path.getmtime(stamp) > KUBE_CACHE_TTL:
+        shutil.rmtree(kube_cache_dir, ignore_errors=True)
+    if not os.path.exists(stamp):
+        os.makedirs(kube_cache_dir, exist_ok=True)
+        open(stamp, 'w').close()
+    return [f'--cache-dir={kube_cache_dir}']
+
+
+def api_resources():
+    # Resource types from the discovery documents, core group first and each group's preferred version before the
+    # others. Read from the API rather than the kubectl api-resources table, whose columns differ between kubectl
+    # versions. A group version that fails (e.g. an unavailable aggregated API) is skipped.
+    core = json.loads(run_command('kubectl get --raw /api', log_output=False))
+    group_versions = [f'/api/{v}' for v in core['versions']]
+    for group in json.loads(run_command('kubectl get --raw /apis', log_output=False))['groups']:
+        preferred = group.get('preferredVersion', {}).get('groupVersion')
+        versions = [v['groupVersion'] for v in group['versions']]
+        group_versions += [f'/apis/{v}' for v in sorted(versions, key=lambda v: v != preferred)]
+    for prefix in group_versions:
+        try:
+            discovery = json.loads(run_command(f'kubectl get --raw {prefix}', log_output=False))
+        except Exception as e:
+            LOG.warning(f'skipping {prefix}: {e}')
+            continue
+        for resource in discovery.get('resources', []):
+            if '/' not in resource['name']:
+                yield prefix, resource
+
+
+def resolve_resource(name):
+    key = (kubeconfig_cluster, name)
+    if key in api_paths:
+        return api_paths[key]
+    resource_type, _, group = name.lower().partition('.')
+    for prefix, resource in api_resources():
+        row_group = prefix[len('/apis/'):].rpartition('/')[0] if prefix.startswith('/apis/') else ''
+        names = [resource['name'], resource['kind'].lower()] + resource.get('shortNames', [])
+        if resource_type not in names or (group and row_group != group and not row_group.startswith(group + '.')):
+            continue
+        api_paths[key] = (prefix, resource['name'], resource['namespaced'])
+        return api_paths[key]
+    raise Exception(f'error: the server doesn\'t have a resource type "{name}"')
+
+
+def kubectl_select(model: ResourceModel):
+    template = jsonpath.parse(model.JsonPath)
+    separator = jsonpath.page_separator(template)
+    prefix, plural, namespaced = resolve_resource(model.Name)
+    path = f'{prefix}/{plural}'
+    if namespaced and not model.AllNamespaces:
+        path = f'{prefix}/namespaces/{model.Namespace}/{plural}'
+    params = {'limit': PAGE_SIZE}
+    if model.LabelSelector:
+        params['labelSelector'] = model.LabelSelector
+    if model.FieldSelector:
+        params['fieldSelector'] = model.FieldSelector
+    outp, size = [], 0
+    while True:
+        page = json.loads(run_command(f'kubectl get --raw {shlex.quote(path + "?" + urlencode(params))}', log_output=False))
+        text = jsonpath.evaluate(template, page)
+        if text:
+            if outp:
+                text = separator + text
+            outp.append(text)
+            size += len(text.encode('utf-8'))
+            if size > MAX_RESPONSE_BYTES:
+                raise ResponseTooLarge(f'response for {model.Name} is larger than {MAX_RESPONSE_BYTES} bytes, narrow the '
+                                f'selectors or JsonPath')
+        params['continue'] = page.get('metadata', {}).get('continue')
+        if not params['continue']:
+            break
+    return ''.join(outp)
 
 
 def kubectl_get(model: ResourceModel, sess) -> ProgressEvent    :
@@ -64,20 +221,30 @@ def kubectl_get(model: ResourceModel, sess) -> ProgressEvent    :
             status=OperationStatus.SUCCESS,
             resourceModel=ResourceModel._deserialize(resp)
         )
-    create_kubeconfig(model.ClusterName)
+    create_kubeconfig(model.ClusterName, sess)
     retry_timeout = 600
+    attempt = 0
     while True:
         try:
-            outp = run_command('kubectl get %s -o jsonpath="%s" --namespace %s' % (model.Name, model.JsonPath, model.Namespace))
+            if model.LabelSelector or model.FieldSelector or model.AllNamespaces:
+                outp = kubectl_select(model)
+            else:
+                outp = run_command('kubectl get %s -o jsonpath="%s" --namespace %s' % (model.Name, model.JsonPath, model.Namespace))
             break
+        except (jsonpath.JsonPathError, ResponseTooLarge):
+            raise
         except Exception as e:
+            # the resource type may have moved to another API version since it was resolved
+            api_paths.pop((kubeconfig_cluster, model.Name), None)
             if retry_timeout < 1:
                 raise
             else:
                 LOG.error('Exception: %s' % e, exc_info=True)
                 LOG.info("retrying until timeout...")
-                time.sleep(5)
-                retry_timeout = retry_timeout - 5
+                delay = min(throttle.backoff(attempt, base=2), retry_timeout)
+                time.sleep(delay)
+                retry_timeout = retry_timeout - max(delay, 1)
+                attempt += 1
     model.Response = outp
     if len(outp.encode('utf-8')) > 1000:
         outp = 'MD5-' + str(md5(outp.encode('utf-8')).hexdigest())
@@ -94,6 +261,7 @@ def set_id(model: ResourceModel):
 
 
 @resource.handler(Action.CREATE)
+@profile_handler
 def create_handler(
     session: Optional[SessionProxy],
     request: ResourceHandlerRequest,
@@ -101,7 +269,8 @@ def create_handler(
 ) -> ProgressEvent:
     LOG.error("create handler invoked")
     model = request.desiredResourceState
-    put_function(session, model._serialize())
+    if proxy_needed(model.ClusterName, session):
+        put_function(session, model._serialize())
     return ProgressEvent(
         status=OperationStatus.SUCCESS,
         resourceModel=model,
@@ -109,6 +278,7 @@ def create_handler(
 
 
 @resource.handler(Action.UPDATE)
+@profile_handler
 def update_handler(
     session: Optional[SessionProxy],
     request: ResourceHandlerRequest,
@@ -123,6 +293,7 @@ def update_handler(
 
 
 @resource.handler(Action.DELETE)
+@profile_handler
 def delete_handler(
     session: Optional[SessionProxy],
     request: ResourceHandlerRequest,
@@ -137,6 +308,7 @@ def delete_handler(
 
 
 @resource.handler(Action.READ)
+@profile_handler
 def read_handler(
     session: Optional[SessionProxy],
     request: ResourceHandlerRequest,
@@ -148,6 +320,7 @@ def read_handler(
 
 
 @resource.handler(Action.LIST)
+@profile_handler
 def list_handler(
     session: Optional[SessionProxy],
     request: ResourceHandlerRequest,
@@ -160,7 +333,31 @@ def list_handler(
     )
 
 
+@record_duration
+@profile_proxy
 def proxy_wrap(event, _context):
+    if event.get('warmup'):
+        LOG.info('keep-warm ping')
+        return {}
+    event.pop('profile', None)
     model = ResourceModel._deserialize(event)
-    progress = kubectl_get(model, boto3.session.Session())
+    progress = kubectl_get(model, proxy_session)
     return progress.resourceModel._serialize()
+
+
+def proxy_init():
+    # The proxy function is deployed with PROXY_CLUSTER_NAME set, resolve credentials
+    # and build the kubeconfig during init rather than on the first proxied query.
+    cluster_name = os.environ.get('PROXY_CLUSTER_NAME')
+    if not cluster_name:
+        return None
+    session = boto3.session.Session()
+    session.get_credentials()
+    try:
+        create_kubeconfig(cluster_name, session)
+    except Exception as e:
+        LOG.warning(f'eager kubeconfig init failed, will retry on invoke: {e}')
+    return session
+
+
+proxy_session = proxy_init() or boto3.session.Session()
@@ -0,0 +1,229 @@
+import json
+import operator
+import re
+
+# A subset of the kubectl JSONPath template syntax, enough to evaluate a Get's JsonPath
+# against one page of a list at a time: text, {.field}, {['field']}, {[n]}, {[a:b]},
+# {[*]}, {..field}, {[?(@.field == 'value')]}, quoted literals and {range}...{end}.
+# Missing fields print nothing, like kubectl with --allow-missing-template-keys.
+
+TOKEN = re.compile(
+    r"""\.\.(?P<descend>(?:\\\.|[^.\[\]\s])+)
+    |\.(?P<field>(?:\\\.|[^.\[\]\s])+)
+    |\[\s*'(?P<squoted>[^']*)'\s*\]
+    |\[\s*"(?P<dquoted>[^"]*)"\s*\]
+    |\[\s*\?\(\s*(?P<filter>.*?)\s*\)\s*\]
+    |\[\s*(?P<subscript>[^\]]*)\s*\]""",
+    re.VERBOSE,
+)
+FILTER = re.compile(r"@((?:\.[^.\s=!<>]+)*)\s*(?:(==|!=|<=|>=|<|>)\s*(.+))?$")
+ESCAPE = re.compile(r"\\(u[0-9a-fA-F]{4}|.)", re.DOTALL)
+ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "\\": "\\", '"': '"', "'": "'"}
+OPERATORS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    ">": operator.gt,
+    "<=": operator.le,
+    ">=": operator.ge,
+}
+
+
+class JsonPathError(Exception):
+    pass
+
+
+def parse(template):
+    # Returns the template as a tree of ("text", str), ("path", steps) and
+    # ("range", steps, body) nodes.
+    nodes, stack, pos = [], [], 0
+    while pos < len(template):
+        start = template.find("{", pos)
+        if start < 0:
+            nodes.append(("text", template[pos:]))
+            break
+        if start > pos:
+            nodes.append(("text", template[pos:start]))
+        end = block_end(template, start)
+        expression = template[start + 1 : end].strip()
+        pos = end + 1
+        if expression.startswith("range "):
+            stack.append((nodes, steps(expression[len("range ") :])))
+            nodes = []
+        elif expression == "end":
+            if not stack:
+                raise JsonPathError(f"unexpected {{end}} in {template}")
+            parent, path = stack.pop()
+            parent.append(("range", path, nodes))
+            nodes = parent
+        elif expression[:1] in ("'", '"') and expression[-1:] == expression[:1]:
+            nodes.append(("text", unescape(expression[1:-1])))
+        else:
+            nodes.append(("path", steps(expression)))
+    if stack:
+        raise JsonPathError(f"missing {{end}} in {template}")
+    return nodes
+
+
+def page_separator(nodes):
+    # Evaluating a template one page of a list at a time only gives the output of the
+    # whole list for a single path or {range} over every (or every matching) item.
+    # Indices, slices, text and further expressions outside the items would be applied
+    # to each page. Returns what goes between the output of consecutive pages.
+    if len(nodes) == 1 and nodes[0][0] in ("path", "range"):
+        path = nodes[0][1]
+        if (
+            len(path) > 1
+            and path[0] == ("field", "items")
+            and (path[1] == ("subscript", "*") or path[1][0] == "filter")
+        ):
+            return " " if nodes[0][0] == "path" else ""
+    raise JsonPathError(
+        "a JsonPath evaluated one page of a list at a time must be a single "
+        "{.items[*]...} or {range .items[*]}...{end}"
+    )
+
+
+def block_end(template, start):
+    quote = None
+    for i in range(start + 1, len(template)):
+        c = template[i]
+        if quote:
+            if c == quote and template[i - 1] != "\\":
+                quote = None
+        elif c in ("'", '"'):
+            quote = c
+        elif c == "}":
+            return i
+    raise JsonPathError(f"unclosed {{ in {template}")
+
+
+def unescape(text):
+    # only the escape sequences are decoded, other characters (including non-ASCII
+    # ones) are kept as they are
+    return ESCAPE.sub(
+        lambda m: (
+            chr(int(m.group(1)[1:], 16))
+            if len(m.group(1)) == 5
+            else ESCAPES.get(m.group(1), m.group(0))
+        ),
+        text,
+    )
+
+
+def steps(expression):
+    expression = expression.lstrip("$@")
+    result, pos = [], 0
+    while pos < len(expression):
+        match = TOKEN.match(expression, pos)
+        if not match:
+            raise JsonPathError(f"unsupported jsonpath expression {expression}")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind in ("squoted", "dquoted"):
+            kind = "field"
+        elif kind in ("field", "descend"):
+            value = value.replace("\\.", ".")
+        result.append((kind, value))
+        pos = match.end()
+    return result
+
+
+def evaluate(nodes, data):
+    out = []
+    for node in nodes:
+        if node[0] == "text":
+            out.append(node[1])
+        elif node[0] == "path":
+            out.append(" ".join(render(v) for v in select(node[1], [data])))
+        else:
+            for value in select(node[1], [data]):
+                out.append(evaluate(node[2], value))
+    return "".join(out)
+
+
+def render(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if value is None:
+        return "null"
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(",", ":"))
+    return str(value)
+
+
+def select(path, values):
+    for kind, arg in path:
+        values = [v for value in values for v in step(kind, arg, value)]
+    return values
+
+
+def step(kind, arg, value):
+    if kind == "field":
+        if arg == "*":
+            return list(value.values()) if isinstance(value, dict) else []
+        return [value[arg]] if isinstance(value, dict) and arg in value else []
+    if kind == "descend":
+        return descend(arg, value)
+    if kind == "filter":
+        items = value if isinstance(value, list) else []
+        return [item for item in items if matches(arg, item)]
+    # subscript: *, index or slice
+    if isinstance(value, dict) and arg == "*":
+        return list(value.values())
+    if not isinstance(value, list):
+        return []
+    if arg == "*":
+        return value
+    try:
+        if ":" in arg:
+            bounds = [int(b) if b.strip() else None for b in arg.split(":")]
+            return value[slice(*bounds)]
+        index = int(arg)
+    except ValueError:
+        raise JsonPathError(f"unsupported subscript [{arg}]")
+    return [value[index]] if -len(value) <= index < len(value) else []
+
+
+def descend(field, value):
+    found = []
+    if isinstance(value, dict):
+        if field in value:
+            found.append(value[field])
+        children = value.values()
+    elif isinstance(value, list):
+        children = value
+    else:
+        return found
+    for child in children:
+        found.extend(descend(field, child))
+    return found
+
+
+def matches(expression, item):
+    match = FILTER.match(expression)
+    if not match:
+        raise JsonPathError(f"unsupported filter ?({expression})")
+    path, op, operand = match.groups()
+    values = select(steps(path), [item])
+    if not op:
+        return bool(values)
+    operand = literal(operand.strip())
+    for value in values:
+        try:
+            if OPERATORS[op](value, operand):
+                return True
+        except TypeError:
+            continue
+    return False
+
+
+def literal(text):
+    if text[:1] in ("'", '"') and text[-1:] == text[:1]:
+        return text[1:-1]
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
@@ -43,6 +43,9 @@ class ResourceModel(BaseModel):
     Name: Optional[str]
     Namespace: Optional[str]
     JsonPath: Optional[str]
+    LabelSelector: Optional[str]
+    FieldSelector: Optional[str]
+    AllNamespaces: Optional[bool]
     Response: Optional[str]
     Id: Optional[str]
 
@@ -60,6 +63,9 @@ class ResourceModel(BaseModel):
             Name=json_data.get("Name"),
             Namespace=json_data.get("Namespace"),
             JsonPath=json_data.get("JsonPath"),
+            LabelSelector=json_data.get("LabelSelector"),
+            FieldSelector=json_data.get("FieldSelector"),
+            AllNamespaces=json_data.get("AllNamespaces"),
             Response=json_data.get("Response"),
             Id=json_data.get("Id"),
         )
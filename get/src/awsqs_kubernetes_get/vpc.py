@@ -1,38 +1,151 @@
+import base64
 import boto3
+import functools
+import hashlib
+import io
 import os
+import socket
+import ssl
+import zipfile
 import traceback
 from string import ascii_lowercase
-from random import choice
+from random import choice, uniform
 import json
 import logging
 import shutil
+import sys
+import threading
 import time
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
+from urllib.parse import urlparse
+
+from . import profiling, throttle
 
 LOG = logging.getLogger(__name__)
 
+# per cluster proxy functions are named PROXY_PREFIX + cluster name
+PROXY_PREFIX = 'awsqs-kubernetes-resource-get-proxy-'
+
+# EventBridge schedule used to ping the proxy so that a warm, VPC-attached
+# execution environment is available when the first real query arrives. The rule is named after the proxy function.
+# Rules of clusters that no longer exist are removed whenever a proxy is deployed.
+KEEP_WARM_SCHEDULE = 'rate(5 minutes)'
+# proxies whose keep-warm rule this execution environment has put in place
+warmed = set()
+
+# Binaries and dependencies shared by every per-cluster proxy are published once as a
+# layer version whose description is the content hash computed at build time.
+LAYER_NAME = 'awsqs-kubernetes-resource-get-proxy'
+
+# Proxies this execution environment has already deployed or found up to date, by function name, so that warm
+# handlers skip the checks in put_function.
+DEPLOYED_TTL = 300
+deployed = {}
+deploy_locks = {}
+deploy_locks_lock = threading.Lock()
+
+# A handler deploying a proxy holds a lease, recorded in the function description, that other handlers wait on. It
+# expires in case the handler dies while deploying.
+LEASE_PREFIX = 'deploy lease '
+LEASE_SECONDS = 600
+LEASE_POLL = 5
+
+# describe_cluster results by cluster name, shared by proxy_needed and put_function, and the VPC config of the function
+# this code runs in
+CLUSTER_TTL = 300
+clusters = {}
+own_vpc_config = None
+
+# The proxy runs the handler's own code and dependencies, so it needs the same runtime.
+PROXY_RUNTIME = f'python{sys.version_info.major}.{sys.version_info.minor}'
+
+# Per cluster proxy sizing and API limits, a JSON object in an SSM parameter named after the cluster, shared with the
+# AWSQS::Kubernetes::Resource proxy, e.g. {"MemorySize": 1024, "Timeout": 300} or
+# {"AutoTune": true, "TargetDuration": 5}.
+# KubeApiQps and KubeApiBurst limit the kubectl commands of each execution environment (handler or proxy) sending to the
+# cluster, MaxConcurrency is reserved for the proxy so that at most that many proxy environments do, 0 leaves either
+# unlimited. Handlers that reach the cluster directly aren't counted. Profile and ProfileS3 switch on profiling (see
+# profiling.py).
+PROXY_CONFIG_PREFIX = '/awsqs-kubernetes-resource/proxy-config'
+DEFAULT_PROXY_CONFIG = {
+    'MemorySize': 512, 'Timeout': 900, 'AutoTune': False, 'TargetDuration': 5,
+    'KubeApiQps': throttle.DEFAULT_QPS, 'KubeApiBurst': throttle.DEFAULT_BURST, 'MaxConcurrency': 0,
+    'Profile': False, 'ProfileS3': ''
+}
+# proxy configs by cluster name, for the API limits read when a kubeconfig is written
+SETTINGS_TTL = 60
+settings_cache = {}
+MEMORY_TIERS = [512, 1024, 1769, 3008]
+METRIC_NAMESPACE = 'AWSQS/KubernetesResource'
+TUNE_WINDOW = 3600
+TUNE_MIN_WINDOW = 900
+TUNE_MIN_SAMPLES = 20
+TUNE_HEADROOM = 0.7
+
+# Clusters with a public endpoint that this environment can reach are queried directly, authenticated with the
+# handler's own credentials, rather than through the proxy. Reachability is probed with a TLS handshake against the
+# cluster CA and cached per endpoint, an endpoint restricted by publicAccessCidrs fails the probe.
+PROBE_TTL = 300
+PROBE_TIMEOUT = 3
+probes = {}
+
 
 def proxy_needed(cluster_name: str, boto3_session: boto3.Session) -> (boto3.client, str):
     # If there's no vpc zip then we're already in the inner lambda.
     if not Path('./awsqs_kubernetes_get/vpc.zip').resolve().exists():
         return False
-    eks = boto3_session.client('eks')
-    eks_vpc_config = eks.describe_cluster(name=cluster_name)['cluster']['resourcesVpcConfig']
-    # for now we will always use vpc proxy, until we can work out how to wrap boto3 session in CFN registry when authing
-    # if eks_vpc_config['endpointPublicAccess'] and '0.0.0.0/0' in eks_vpc_config['publicAccessCidrs']:
-    #    return False
+    cluster = describe_cluster(boto3_session, cluster_name)
+    eks_vpc_config = cluster['resourcesVpcConfig']
+    if eks_vpc_config.get('endpointPublicAccess') and endpoint_reachable(cluster):
+        return False
     if this_invoke_is_inside_vpc(set(eks_vpc_config['subnetIds']), set(eks_vpc_config['securityGroupIds'])):
         return False
     return True
 
 
+def describe_cluster(sess, cluster_name):
+    cached = clusters.get(cluster_name)
+    if cached and time.time() - cached[0] < CLUSTER_TTL:
+        return cached[1]
+    cluster = sess.client('eks').describe_cluster(name=cluster_name)['cluster']
+    clusters[cluster_name] = (time.time(), cluster)
+    return cluster
+
+
+def endpoint_reachable(cluster):
+    endpoint = cluster['endpoint']
+    cached = probes.get(endpoint)
+    if cached and time.time() - cached[0] < PROBE_TTL:
+        return cached[1]
+    reachable = probe_endpoint(endpoint, cluster['certificateAuthority']['data'])
+    probes[endpoint] = (time.time(), reachable)
+    return reachable
+
+
+def probe_endpoint(endpoint, ca_data):
+    host = urlparse(endpoint).hostname
+    try:
+        # malformed CA data fails the probe too
+        context = ssl.create_default_context(cadata=base64.b64decode(ca_data).decode('utf-8'))
+        with socket.create_connection((host, 443), timeout=PROBE_TIMEOUT) as sock:
+            with context.wrap_socket(sock, server_hostname=host):
+                return True
+    except (OSError, ValueError) as e:
+        LOG.info(f'{endpoint} is not reachable, using the vpc proxy: {e}')
+        return False
+
+
 def this_invoke_is_inside_vpc(subnet_ids: set, sg_ids: set) -> bool:
+    global own_vpc_config
     lmbd = boto3.client('lambda')
     try:
-        lambda_config = lmbd.get_function_configuration(FunctionName=os.environ['AWS_LAMBDA_FUNCTION_NAME'])
-        l_vpc_id = lambda_config['VpcConfig'].get('VpcId', '')
-        l_subnet_ids = set(lambda_config['VpcConfig'].get('subnetIds', ''))
-        l_sg_ids = set(lambda_config['VpcConfig'].get('securityGroupIds', ''))
+        if own_vpc_config is None:
+            own_vpc_config = lmbd.get_function_configuration(
+                FunctionName=os.environ['AWS_LAMBDA_FUNCTION_NAME'])['VpcConfig']
+        l_vpc_id = own_vpc_config.get('VpcId', '')
+        l_subnet_ids = set(own_vpc_config.get('subnetIds', ''))
+        l_sg_ids = set(own_vpc_config.get('securityGroupIds', ''))
         if l_vpc_id and l_subnet_ids.issubset(subnet_ids) and l_sg_ids.issubset(sg_ids):
             return True
     except Exception as e:
@@ -42,16 +155,32 @@ def this_invoke_is_inside_vpc(subnet_ids: set, sg_ids: set) -> bool:
 
 
 def proxy_call(event, sess):
-    return invoke_function(f'awsqs-kubernetes-resource-get-proxy-{event["ClusterName"]}', event, sess)
+    return invoke_function(f'{PROXY_PREFIX}{event["ClusterName"]}', event, sess)
 
 
 def random_string(length=8):
     return ''.join(choice(ascii_lowercase) for _ in range(length))
 
 
-def put_function(sess, event):
-    eks = sess.client('eks')
-    eks_vpc_config = eks.describe_cluster(name=event['ClusterName'])['cluster']['resourcesVpcConfig']
+def put_function(sess, event, keep_warm=True):
+    function_name = f'{PROXY_PREFIX}{event["ClusterName"]}'
+    with function_lock(function_name):
+        update_function(sess, event, function_name)
+        # kept apart from the deploy, which only one handler performs, so that a failed keep-warm setup is retried by
+        # the next caller
+        if keep_warm and function_name not in warmed:
+            try:
+                put_keep_warm(sess, function_name)
+                warmed.add(function_name)
+            except Exception as e:
+                LOG.warning(f'failed to set up keep-warm for {function_name}: {e}')
+
+
+def update_function(sess, event, function_name):
+    checked = deployed.get(function_name)
+    if checked and time.time() - checked < DEPLOYED_TTL:
+        return
+    eks_vpc_config = describe_cluster(sess, event['ClusterName'])['resourcesVpcConfig']
     ec2 = sess.client('ec2')
     internal_subnets = [
         s['SubnetId'] for s in
@@ -62,71 +191,383 @@ def put_function(sess, event):
     sts = sess.client('sts')
     role_arn = '/'.join(sts.get_caller_identity()['Arn'].replace(':sts:', ':iam:').replace(':assumed-role/', ':role/')
                         .split('/')[:-1])
+    settings = proxy_settings(sess, event['ClusterName'])
+    profiling.configure(event['ClusterName'], settings)
+    memory, timeout = proxy_sizing(sess, settings, function_name)
+    config = {
+        'Runtime': PROXY_RUNTIME,
+        'Role': role_arn,
+        'Handler': 'awsqs_kubernetes_get.handlers.proxy_wrap',
+        'Timeout': timeout,
+        'MemorySize': memory,
+        'VpcConfig': {
+            'SubnetIds': internal_subnets,
+            'SecurityGroupIds': eks_vpc_config['securityGroupIds']
+        },
+        'Environment': {'Variables': {'PROXY_CLUSTER_NAME': event['ClusterName']}}
+    }
+    with open('./awsqs_kubernetes_get/vpc.zip', 'rb') as zip_file:
+        code = zip_file.read()
+    if deploy_function(sess, function_name, code, config):
+        remove_stale_keep_warm(sess)
+    limit_concurrency(sess, function_name, settings['MaxConcurrency'])
+    deployed[function_name] = time.time()
+
+
+def limit_concurrency(sess, function_name, limit):
+    # The reservation comes out of the account's unreserved concurrency, which Lambda won't let drop below 100. The
+    # proxy works without it, so failing to set it isn't an error.
     lmbd = sess.client('lambda')
     try:
-        with open('./awsqs_kubernetes_get/vpc.zip', 'rb') as zip_file:
-            lmbd.create_function(
-                FunctionName=f'awsqs-kubernetes-resource-get-proxy-{event["ClusterName"]}',
-                Runtime='python3.7',
-                Role=role_arn,
-                Handler="awsqs_kubernetes_get.handlers.proxy_wrap",
-                Code={'ZipFile': zip_file.read()},
-                Timeout=900,
-                MemorySize=512,
-                VpcConfig={
-                    'SubnetIds': internal_subnets,
-                    'SecurityGroupIds': eks_vpc_config['securityGroupIds']
-                }
-            )
-    except lmbd.exceptions.ResourceConflictException as e:
-        if "Function already exist" not in str(e):
-            raise
-        LOG.warning("function already exists...")
-        while True:
-            try:
-                with open('./awsqs_kubernetes_get/vpc.zip', 'rb') as zip_file:
-                    lmbd.update_function_code(
-                        FunctionName=f'awsqs-kubernetes-resource-get-proxy-{event["ClusterName"]}',
-                        ZipFile=zip_file.read()
-                    )
-                break
-            except lmbd.exceptions.ResourceConflictException as e:
-                if "The operation cannot be performed at this time." not in str(e):
-                    raise
-                LOG.error(str(e))
-                time.sleep(10)
-        while True:
+        current = lmbd.get_function_concurrency(FunctionName=function_name).get('ReservedConcurrentExecutions')
+        if current == (limit or None):
+            return
+        if limit:
+            lmbd.put_function_concurrency(FunctionName=function_name, ReservedConcurrentExecutions=limit)
+        else:
+            lmbd.delete_function_concurrency(FunctionName=function_name)
+    except Exception as e:
+        LOG.warning(f'failed to set the reserved concurrency of {function_name}: {e}')
+
+
+def configure_throttle(sess, cluster_name):
+    settings = cluster_settings(sess, cluster_name)
+    throttle.configure(cluster_name, settings['KubeApiQps'], settings['KubeApiBurst'])
+
+
+def cluster_settings(sess, cluster_name):
+    # Operations don't fail over settings that can't be read, they fall back to the defaults. Deploying the proxy reads
+    # the config itself and does fail.
+    cached = settings_cache.get(cluster_name)
+    if cached and time.time() - cached[0] < SETTINGS_TTL:
+        return cached[1]
+    try:
+        settings = proxy_settings(sess, cluster_name)
+    except Exception as e:
+        LOG.warning(f'using the default proxy config for {cluster_name}: {e}')
+        settings = dict(DEFAULT_PROXY_CONFIG)
+    profiling.configure(cluster_name, settings)
+    settings_cache[cluster_name] = (time.time(), settings)
+    return settings
+
+
+def function_lock(function_name):
+    with deploy_locks_lock:
+        return deploy_locks.setdefault(function_name, threading.Lock())
+
+
+def deploy_function(sess, function_name, code, config):
+    # Single flight across handlers: a caller that finds the function out of date claims a lease in its description,
+    # conditional on the RevisionId it compared against, so only one caller per revision wins. The winner publishes the
+    # layer and updates the function, everyone else waits for the lease to be released (or to expire) and compares
+    # again. Returns True if this caller deployed.
+    lmbd = sess.client('lambda')
+    code_sha256 = base64.b64encode(hashlib.sha256(code).digest()).decode('utf-8')
+    content_hash = Path('./awsqs_kubernetes_get/layer.sha256').read_text().strip()
+    lease = f'{LEASE_PREFIX}{random_string(16)} {int(time.time()) + LEASE_SECONDS}'
+    while True:
+        current = wait_for_function(lmbd, function_name)
+        if current is None:
             try:
-                lmbd.update_function_configuration(
-                    FunctionName=f'awsqs-kubernetes-resource-get-proxy-{event["ClusterName"]}',
-                    Runtime='python3.7',
-                    Role=role_arn,
-                    Handler="awsqs_kubernetes_get.handlers.proxy_wrap",
-                    Timeout=900,
-                    MemorySize=512,
-                    VpcConfig={
-                        'SubnetIds': internal_subnets,
-                        'SecurityGroupIds': eks_vpc_config['securityGroupIds']
-                    }
-                )
+                lmbd.create_function(FunctionName=function_name, Code={'ZipFile': code}, Description=lease, **config)
                 break
             except lmbd.exceptions.ResourceConflictException as e:
-                if "The operation cannot be performed at this time." not in str(e) and 'The function could not be updated due to a concurrent update operation.' not in str(e):
+                if "Function already exist" not in str(e):
                     raise
-                LOG.error(str(e))
-                time.sleep(10)
+                continue
+        if current['CodeSha256'] == code_sha256 and current_layer(lmbd, current, content_hash) and \
+                config_matches(current, config):
+            return False
+        if lease_held(current):
+            LOG.info(f'{function_name} is being deployed by another handler')
+            time.sleep(uniform(LEASE_POLL / 2, LEASE_POLL))
+            continue
+        try:
+            lmbd.update_function_configuration(FunctionName=function_name, Description=lease,
+                                               RevisionId=current['RevisionId'])
+            break
+        except lmbd.exceptions.PreconditionFailedException:
+            LOG.info(f'{function_name} was updated concurrently')
+        except lmbd.exceptions.ResourceConflictException as e:
+            if "The operation cannot be performed at this time." not in str(e):
+                raise
+    try:
+        current = wait_for_function(lmbd, function_name)
+        layer_arn = current_layer(lmbd, current, content_hash) or put_layer(sess)
+        if current['CodeSha256'] != code_sha256:
+            lmbd.update_function_code(FunctionName=function_name, ZipFile=code)
+            wait_for_function(lmbd, function_name)
+        lmbd.update_function_configuration(FunctionName=function_name, Layers=[layer_arn], Description='', **config)
+        wait_for_function(lmbd, function_name)
+    except Exception:
+        # release the lease so that waiting handlers take over instead of timing out
+        try:
+            lmbd.update_function_configuration(FunctionName=function_name, Description='')
+        except Exception as e:
+            LOG.warning(f'failed to release deploy lease on {function_name}: {e}')
+        raise
+    return True
+
+
+def lease_held(current):
+    description = current.get('Description', '')
+    if not description.startswith(LEASE_PREFIX):
+        return False
+    return int(description.rsplit(' ', 1)[-1]) > time.time()
+
+
+def wait_for_function(lmbd, function_name):
+    delay = 1
+    while True:
+        try:
+            current = lmbd.get_function_configuration(FunctionName=function_name)
+        except lmbd.exceptions.ResourceNotFoundException:
+            return None
+        if current.get('State') != 'Pending' and current.get('LastUpdateStatus') != 'InProgress':
+            return current
+        time.sleep(delay + uniform(0, delay))
+        delay = min(delay * 2, 10)
+
+
+def current_layer(lmbd, current, content_hash):
+    layers = [layer['Arn'] for layer in current.get('Layers', [])]
+    if len(layers) != 1:
+        return None
+    try:
+        version = lmbd.get_layer_version_by_arn(Arn=layers[0])
+    except lmbd.exceptions.ResourceNotFoundException:
+        return None
+    return layers[0] if version.get('Description') == content_hash else None
+
+
+def config_matches(current, config):
+    vpc_config = current.get('VpcConfig', {})
+    return (
+        all(current.get(key) == config[key] for key in ('Runtime', 'Role', 'Handler', 'Timeout', 'MemorySize'))
+        and set(vpc_config.get('SubnetIds', [])) == set(config['VpcConfig']['SubnetIds'])
+        and set(vpc_config.get('SecurityGroupIds', [])) == set(config['VpcConfig']['SecurityGroupIds'])
+        and current.get('Environment', {}).get('Variables', {}) == config['Environment']['Variables']
+    )
+
+
+def proxy_settings(sess, cluster_name):
+    ssm = sess.client('ssm')
+    try:
+        value = ssm.get_parameter(Name=f'{PROXY_CONFIG_PREFIX}/{cluster_name}')['Parameter']['Value']
+    except ssm.exceptions.ParameterNotFound:
+        return dict(DEFAULT_PROXY_CONFIG)
+    try:
+        settings = dict(DEFAULT_PROXY_CONFIG, **json.loads(value))
+        settings['MemorySize'] = int(settings['MemorySize'])
+        settings['Timeout'] = int(settings['Timeout'])
+        settings['TargetDuration'] = float(settings['TargetDuration'])
+        settings['KubeApiQps'] = float(settings['KubeApiQps'])
+        settings['KubeApiBurst'] = int(settings['KubeApiBurst'])
+        settings['MaxConcurrency'] = int(settings['MaxConcurrency'])
+    except (TypeError, ValueError) as e:
+        raise Exception(f'invalid proxy config in {PROXY_CONFIG_PREFIX}/{cluster_name}: {e}')
+    if not 128 <= settings['MemorySize'] <= 10240 or not 1 <= settings['Timeout'] <= 900:
+        raise Exception(f'invalid proxy config in {PROXY_CONFIG_PREFIX}/{cluster_name}: '
+                        f'MemorySize must be 128-10240 and Timeout 1-900')
+    if settings['KubeApiQps'] < 0 or settings['KubeApiBurst'] < 1 or settings['MaxConcurrency'] < 0:
+        raise Exception(f'invalid proxy config in {PROXY_CONFIG_PREFIX}/{cluster_name}: '
+                        f'KubeApiQps and MaxConcurrency must be 0 or more and KubeApiBurst 1 or more')
+    # "false" would otherwise switch tuning on
+    if not isinstance(settings['AutoTune'], bool) or not isinstance(settings['Profile'], bool):
+        raise Exception(f'invalid proxy config in {PROXY_CONFIG_PREFIX}/{cluster_name}: '
+                        f'AutoTune and Profile must be true or false')
+    if settings['ProfileS3'] and not str(settings['ProfileS3']).startswith('s3://'):
+        raise Exception(f'invalid proxy config in {PROXY_CONFIG_PREFIX}/{cluster_name}: '
+                        f'ProfileS3 must be an s3://bucket/prefix URL')
+    return settings
+
+
+def proxy_sizing(sess, settings, function_name):
+    memory = settings['MemorySize']
+    if settings.get('AutoTune'):
+        memory = tuned_memory(sess, function_name, settings['TargetDuration']) or memory
+    return memory, settings['Timeout']
+
+
+def tuned_memory(sess, function_name, target):
+    # Moves the proxy one memory tier up while its p90 duration misses the target, and one tier down when the lower
+    # tier is predicted to meet it with room to spare (CPU, and so kubectl and JSON decoding time, scales with memory).
+    # Only durations recorded since the function was last changed count.
+    lmbd = sess.client('lambda')
+    try:
+        current = lmbd.get_function_configuration(FunctionName=function_name)
+    except lmbd.exceptions.ResourceNotFoundException:
+        return None
+    memory = current['MemorySize']
+    now = datetime.now(timezone.utc)
+    modified = datetime.strptime(current['LastModified'], '%Y-%m-%dT%H:%M:%S.%f%z')
+    start = max(modified, now - timedelta(seconds=TUNE_WINDOW))
+    if (now - start).total_seconds() < TUNE_MIN_WINDOW:
+        return memory
+    p90, samples = proxy_duration(sess, function_name, start, now)
+    if samples < TUNE_MIN_SAMPLES:
+        return memory
+    tiers = sorted(set(MEMORY_TIERS) | {memory})
+    i = tiers.index(memory)
+    if p90 > target and i + 1 < len(tiers):
+        LOG.info(f'{function_name} p90 {p90:.1f}s > {target}s, using {tiers[i + 1]}MB')
+        return tiers[i + 1]
+    if i > 0 and p90 * memory / tiers[i - 1] < target * TUNE_HEADROOM:
+        LOG.info(f'{function_name} p90 {p90:.1f}s, using {tiers[i - 1]}MB')
+        return tiers[i - 1]
+    return memory
+
+
+def proxy_duration(sess, function_name, start, end):
+    metric = {
+        'Namespace': METRIC_NAMESPACE,
+        'MetricName': 'ProxyDuration',
+        'Dimensions': [{'Name': 'FunctionName', 'Value': function_name}]
+    }
+    period = max(60, int((end - start).total_seconds()) // 60 * 60)
+    results = sess.client('cloudwatch').get_metric_data(
+        MetricDataQueries=[
+            {'Id': 'p90', 'MetricStat': {'Metric': metric, 'Period': period, 'Stat': 'p90'}},
+            {'Id': 'samples', 'MetricStat': {'Metric': metric, 'Period': period, 'Stat': 'SampleCount'}}
+        ],
+        StartTime=start,
+        EndTime=end
+    )['MetricDataResults']
+    values = {r['Id']: r['Values'] for r in results}
+    if not values.get('p90'):
+        return 0.0, 0
+    return max(values['p90']) / 1000, sum(values.get('samples', []))
+
+
+def record_duration(func):
+    # Emits the proxy's duration in CloudWatch embedded metric format, which needs no network access from the VPC.
+    # Unlike the Lambda Duration metric it leaves out keep-warm pings.
+    @functools.wraps(func)
+    def wrapper(event, context):
+        if event.get('warmup'):
+            return func(event, context)
+        start = time.perf_counter()
+        try:
+            return func(event, context)
+        finally:
+            metadata = {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': METRIC_NAMESPACE,
+                    'Dimensions': [['FunctionName']],
+                    'Metrics': [{'Name': 'ProxyDuration', 'Unit': 'Milliseconds'}]
+                }]
+            }
+            print(json.dumps({
+                '_aws': metadata,
+                'FunctionName': os.environ.get('AWS_LAMBDA_FUNCTION_NAME'),
+                'ProxyDuration': (time.perf_counter() - start) * 1000
+            }))
+
+    return wrapper
+
+
+def put_layer(sess):
+    lmbd = sess.client('lambda')
+    content_hash = Path('./awsqs_kubernetes_get/layer.sha256').read_text().strip()
+    for page in lmbd.get_paginator('list_layer_versions').paginate(LayerName=LAYER_NAME):
+        for version in page['LayerVersions']:
+            if version.get('Description') == content_hash:
+                return version['LayerVersionArn']
+    LOG.info(f'publishing {LAYER_NAME} layer {content_hash}')
+    return lmbd.publish_layer_version(
+        LayerName=LAYER_NAME,
+        Description=content_hash,
+        Content={'ZipFile': build_layer_zip('awsqs_kubernetes_get')}
+    )['LayerVersionArn']
+
+
+def build_layer_zip(package):
+    # Repackages the handler's own dependencies rather than shipping a second copy in
+    # the handler bundle. bin/ maps to /opt/bin and everything else to /opt/python.
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as layer_zip:
+        for root, dirs, files in os.walk('.'):
+            dirs[:] = sorted(d for d in dirs if d != '__pycache__' and not (root == '.' and d == package))
+            for name in sorted(files):
+                path = os.path.relpath(os.path.join(root, name), '.')
+                arcname = path if path.startswith('bin/') else f'python/{path}'
+                info = zipfile.ZipInfo(arcname, date_time=(2020, 7, 1, 0, 0, 0))
+                info.external_attr = (os.stat(path).st_mode & 0o777 | 0o100000) << 16
+                info.compress_type = zipfile.ZIP_DEFLATED
+                with open(path, 'rb') as fh:
+                    layer_zip.writestr(info, fh.read())
+    return buf.getvalue()
+
+
+def put_keep_warm(sess, function_name):
+    lmbd = sess.client('lambda')
+    events = sess.client('events')
+    function_arn = lmbd.get_function_configuration(FunctionName=function_name)['FunctionArn']
+    rule_arn = events.put_rule(
+        Name=function_name,
+        ScheduleExpression=KEEP_WARM_SCHEDULE,
+        State='ENABLED',
+        Description=f'keep {function_name} warm'
+    )['RuleArn']
+    events.put_targets(
+        Rule=function_name,
+        Targets=[{'Id': 'keep-warm', 'Arn': function_arn, 'Input': json.dumps({'warmup': True})}]
+    )
+    try:
+        lmbd.add_permission(
+            FunctionName=function_name,
+            StatementId='keep-warm',
+            Action='lambda:InvokeFunction',
+            Principal='events.amazonaws.com',
+            SourceArn=rule_arn
+        )
+    except lmbd.exceptions.ResourceConflictException as e:
+        if 'already exists' not in str(e):
+            raise
+
+
+def remove_stale_keep_warm(sess):
+    events = sess.client('events')
+    eks = sess.client('eks')
+    try:
+        for page in events.get_paginator('list_rules').paginate(NamePrefix=PROXY_PREFIX):
+            for rule in page['Rules']:
+                cluster_name = rule['Name'][len(PROXY_PREFIX):]
+                try:
+                    eks.describe_cluster(name=cluster_name)
+                    continue
+                except eks.exceptions.ResourceNotFoundException:
+                    pass
+                LOG.info(f'removing keep-warm rule of deleted cluster {cluster_name}')
+                events.remove_targets(Rule=rule['Name'], Ids=['keep-warm'])
+                events.delete_rule(Name=rule['Name'])
+    except Exception as e:
+        LOG.warning(f'failed to remove stale keep-warm rules: {e}')
 
 
 def invoke_function(func_arn, event, sess):
     lmbd = sess.client('lambda')
+    if profiling.active is not None:
+        event['profile'] = {'s3': profiling.target}
+    attempt = 0
     while True:
         try:
-            response = lmbd.invoke(
-                FunctionName=func_arn,
-                InvocationType='RequestResponse',
-                Payload=json.dumps(event).encode('utf-8')
-            )
-            return json.loads(response['Payload'].read().decode('utf-8'))
+            with profiling.timed('lambda', func_arn):
+                response = lmbd.invoke(
+                    FunctionName=func_arn,
+                    InvocationType='RequestResponse',
+                    Payload=json.dumps(event).encode('utf-8')
+                )
+                return json.loads(response['Payload'].read().decode('utf-8'))
+        except lmbd.exceptions.ResourceNotFoundException:
+            deployed.pop(func_arn, None)
+            raise
+        except lmbd.exceptions.TooManyRequestsException:
+            # every proxy environment the reserved concurrency allows is busy
+            LOG.info(f'{func_arn} is at its concurrency limit')
+            time.sleep(throttle.backoff(attempt, cap=10))
+            attempt += 1
         except lmbd.exceptions.ResourceConflictException as e:
             if "The operation cannot be performed at this time." not in str(e):
                 raise
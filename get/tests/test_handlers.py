@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from awsqs_kubernetes_get import handlers
+
+DISCOVERY = {
+    '/api': {'versions': ['v1']},
+    '/apis': {'groups': [
+        {'name': 'apps', 'versions': [{'groupVersion': 'apps/v1'}], 'preferredVersion': {'groupVersion': 'apps/v1'}},
+        {'name': 'metrics.k8s.io', 'versions': [{'groupVersion': 'metrics.k8s.io/v1beta1'}],
+         'preferredVersion': {'groupVersion': 'metrics.k8s.io/v1beta1'}},
+        {'name': 'autoscaling', 'versions': [{'groupVersion': 'autoscaling/v1'}, {'groupVersion': 'autoscaling/v2'}],
+         'preferredVersion': {'groupVersion': 'autoscaling/v2'}},
+    ]},
+    '/api/v1': {'resources': [
+        {'name': 'pods', 'kind': 'Pod', 'namespaced': True, 'shortNames': ['po']},
+        {'name': 'pods/log', 'kind': 'Pod', 'namespaced': True},
+        {'name': 'nodes', 'kind': 'Node', 'namespaced': False, 'shortNames': ['no']},
+    ]},
+    '/apis/apps/v1': {'resources': [{'name': 'deployments', 'kind': 'Deployment', 'namespaced': True}]},
+    '/apis/autoscaling/v1': {'resources': [
+        {'name': 'horizontalpodautoscalers', 'kind': 'HorizontalPodAutoscaler', 'namespaced': True}
+    ]},
+    '/apis/autoscaling/v2': {'resources': [
+        {'name': 'horizontalpodautoscalers', 'kind': 'HorizontalPodAutoscaler', 'namespaced': True}
+    ]},
+}
+
+
+@pytest.fixture
+def discovery(monkeypatch):
+    def run_command(command, log_output=True):
+        path = command.split()[-1]
+        if path not in DISCOVERY:
+            raise Exception('Error from server (ServiceUnavailable): the server is currently unable to handle the request')
+        return json.dumps(DISCOVERY[path])
+
+    monkeypatch.setattr(handlers, 'run_command', run_command)
+    monkeypatch.setattr(handlers, 'api_paths', {})
+
+
+@pytest.mark.parametrize('name, expected', [
+    ('pods', ('/api/v1', 'pods', True)),
+    ('po', ('/api/v1', 'pods', True)),
+    ('Node', ('/api/v1', 'nodes', False)),
+    ('deployment.apps', ('/apis/apps/v1', 'deployments', True)),
+    ('hpa.autoscaling', None),
+    ('horizontalpodautoscalers', ('/apis/autoscaling/v2', 'horizontalpodautoscalers', True)),
+])
+def test_resolve_resource(discovery, name, expected):
+    if expected is None:
+        with pytest.raises(Exception, match="doesn't have a resource type"):
+            handlers.resolve_resource(name)
+    else:
+        assert handlers.resolve_resource(name) == expected
@@ -0,0 +1,99 @@
+import json
+
+import pytest
+
+from awsqs_kubernetes_get import handlers, jsonpath
+from awsqs_kubernetes_get.models import ResourceModel
+
+
+def pod(name, phase='Running', labels=None):
+    return {'metadata': {'name': name, 'labels': labels or {}}, 'status': {'phase': phase}}
+
+
+PODS = {
+    'kind': 'PodList',
+    'metadata': {'resourceVersion': '7'},
+    'items': [pod('a', labels={'app': 'web'}), pod('b', 'Pending'), pod('c', labels={'app': 'web'})],
+}
+
+
+@pytest.mark.parametrize('template, expected', [
+    ('{.items[*].metadata.name}', 'a b c'),
+    ('{.items[0].metadata.name}', 'a'),
+    ('{.items[-1].metadata.name}', 'c'),
+    ('{.items[1:].metadata.name}', 'b c'),
+    ("{.items[*].metadata['name']}", 'a b c'),
+    ('{..phase}', 'Running Pending Running'),
+    ("{.items[?(@.status.phase == 'Running')].metadata.name}", 'a c'),
+    ('{.items[?(@.metadata.labels.app)].metadata.name}', 'a c'),
+    ('{range .items[*]}{.metadata.name}{","}{end}', 'a,b,c,'),
+    ('names: {.items[*].metadata.name}', 'names: a b c'),
+    ('{.items[5].metadata.name}{.items[*].metadata.missing}', ''),
+    ('{.metadata}', '{"resourceVersion":"7"}'),
+    ('{"→ "}{.items[0].metadata.name}{"\\t\\u00e9\\n"}', '→ a\té\n'),
+])
+def test_evaluate(template, expected):
+    assert jsonpath.evaluate(jsonpath.parse(template), PODS) == expected
+
+
+@pytest.mark.parametrize('template', ['{range .items[*]}{.metadata.name}', '{end}', '{.items[*]', '{.items[x]}'])
+def test_invalid(template):
+    with pytest.raises(jsonpath.JsonPathError):
+        jsonpath.evaluate(jsonpath.parse(template), PODS)
+
+
+@pytest.mark.parametrize('template, separator', [
+    ('{.items[*].metadata.name}', ' '),
+    ("{.items[?(@.status.phase == 'Running')].metadata.name}", ' '),
+    ('{range .items[*]}{.metadata.name}{"\\n"}{end}', ''),
+])
+def test_page_separator(template, separator):
+    assert jsonpath.page_separator(jsonpath.parse(template)) == separator
+
+
+@pytest.mark.parametrize('template', [
+    '{.items[0].metadata.name}',
+    '{.items[1:].metadata.name}',
+    'names: {.items[*].metadata.name}',
+    '{.items[*].metadata.name}{.items[*].status.phase}',
+    '{..name}',
+    '{.items}',
+])
+def test_page_separator_rejects_page_variant_templates(template):
+    with pytest.raises(jsonpath.JsonPathError):
+        jsonpath.page_separator(jsonpath.parse(template))
+
+
+@pytest.mark.parametrize('template', [
+    '{.items[*].metadata.name}',
+    '{range .items[*]}{.metadata.name}{","}{end}',
+    "{.items[?(@.metadata.labels.app == 'web')].status.phase}",
+])
+def test_select_over_pages_matches_whole_list(monkeypatch, template):
+    pages = [
+        {'metadata': {'continue': 'p2'}, 'items': PODS['items'][:2]},
+        {'metadata': {'continue': ''}, 'items': PODS['items'][2:]},
+    ]
+    commands = []
+
+    def run_command(command, log_output=True):
+        commands.append(command)
+        return json.dumps(pages[len(commands) - 1])
+
+    monkeypatch.setattr(handlers, 'run_command', run_command)
+    monkeypatch.setattr(handlers, 'resolve_resource', lambda name: ('/api/v1', 'pods', True))
+    model = ResourceModel._deserialize({
+        'ClusterName': 'c', 'Namespace': 'default', 'Name': 'pods', 'JsonPath': template, 'LabelSelector': 'x=y'
+    })
+    assert handlers.kubectl_select(model) == jsonpath.evaluate(jsonpath.parse(template), PODS)
+    assert len(commands) == 2 and 'continue=p2' in commands[1]
+
+
+def test_select_rejects_page_variant_template(monkeypatch):
+    monkeypatch.setattr(handlers, 'run_command', lambda *_a, **_k: pytest.fail('queried the cluster'))
+    model = ResourceModel._deserialize({
+        'ClusterName': 'c', 'Namespace': 'default', 'Name': 'pods', 'JsonPath': '{.items[0].metadata.name}',
+        'AllNamespaces': True
+    })
+    with pytest.raises(jsonpath.JsonPathError):
+        handlers.kubectl_select(model)
@@ -0,0 +1,855 @@
+"""Concurrency stress harness for the AWSQS::Kubernetes::Resource and Get handlers.
+
+Replays CloudFormation handler requests for many resources targeting the same
+cluster at a configurable concurrency. Lambda, EKS, EC2, STS, SSM, EventBridge and
+the kubernetes apiserver are replaced with in-process fakes, so the run exercises the
+real handler and vpc code paths (proxy deployment, retries, callbacks) without AWS.
+
+Requires the handler dependencies (cloudformation-cli-python-lib, boto3, ruamel.yaml,
+requests) to be installed. Example:
+
+    python tools/stress.py --resources 100 --gets 50 --concurrency 64
+"""
+
+import argparse
+import base64
+import hashlib
+import io
+import json
+import logging
+import os
+import random
+import shlex
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[0:0] = [os.path.join(ROOT, "apply", "src"), os.path.join(ROOT, "get", "src")]
+
+from cloudformation_cli_python_lib import OperationStatus  # noqa: E402
+
+from awsqs_kubernetes_resource import handlers as apply_handlers  # noqa: E402
+from awsqs_kubernetes_resource import vpc as apply_vpc  # noqa: E402
+from awsqs_kubernetes_resource.models import ResourceModel as ApplyModel  # noqa: E402
+from awsqs_kubernetes_get import handlers as get_handlers  # noqa: E402
+from awsqs_kubernetes_get import vpc as get_vpc  # noqa: E402
+from awsqs_kubernetes_get.models import ResourceModel as GetModel  # noqa: E402
+
+CLUSTER = "stress"
+HANDLER_FUNCTION = "awsqs-kubernetes-resource-handler"
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = Counter()
+        self.retry_sleeps = Counter()
+
+    def incr(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+
+class Clock:
+    # Scales every sleep in the code under test so that 10s retry loops and callback
+    # delays keep their relative weight without making a run take hours.
+    def __init__(self, scale, stats):
+        self.scale = scale
+        self.stats = stats
+
+    def sleep(self, seconds):
+        time.sleep(seconds * self.scale)
+
+    def retry_sleep(self, seconds):
+        caller = sys._getframe(1).f_code.co_name
+        with self.stats.lock:
+            self.stats.retry_sleeps[caller] += 1
+        self.sleep(seconds)
+
+
+class ResourceConflictException(Exception):
+    pass
+
+
+class PreconditionFailedException(Exception):
+    pass
+
+
+class ResourceNotFoundException(Exception):
+    pass
+
+
+class TooManyRequestsException(Exception):
+    pass
+
+
+class ParameterNotFound(Exception):
+    pass
+
+
+class KubectlError(Exception):
+    pass
+
+
+class FakeApiServer:
+    def __init__(self, clock, stats, latency, list_cost):
+        self.clock = clock
+        self.stats = stats
+        self.latency = latency
+        self.list_cost = list_cost
+        self.lock = threading.Lock()
+        self.objects = {}
+        self.resource_version = 0
+
+    def request(self, cost=0.0):
+        self.stats.incr("apiserver requests")
+        self.clock.sleep(self.latency + cost)
+
+    def kubectl(self, command, manifest=None):
+        args = shlex.split(command)
+        if args[0] == "aws" or args[1] in ("config", "version"):
+            return ""
+        self.stats.incr(f"kubectl {args[1]}")
+        flags, positional = self.parse(args[2:])
+        namespace = flags.get("-n") or flags.get("--namespace") or "default"
+        if args[1] in ("create", "apply"):
+            return self.write(args[1], manifest, namespace)
+        if args[1] == "get":
+            return self.get(
+                positional, namespace, flags.get("-o", ""), flags.get("--raw")
+            )
+        if args[1] == "delete":
+            return self.delete(positional, namespace, flags, manifest)
+        if args[1] == "wait":
+            self.request()
+            return ""
+        raise KubectlError(f"error: unknown command {args[1]}")
+
+    @staticmethod
+    def parse(args):
+        flags, positional = {}, []
+        i = 0
+        while i < len(args):
+            if args[i].startswith("-") and "=" in args[i]:
+                flag, value = args[i].split("=", 1)
+                flags[flag] = value
+            elif args[i].startswith("-") and i + 1 < len(args):
+                flags[args[i]] = args[i + 1]
+                i += 1
+            else:
+                positional.append(args[i])
+            i += 1
+        return flags, positional
+
+    def write(self, verb, manifest, namespace):
+        try:
+            document = json.loads(manifest)
+        except (TypeError, ValueError):
+            # another handler in this process rewrote the shared manifest file
+            self.stats.incr("manifest races")
+            raise KubectlError("error: no objects passed to " + verb)
+        items = document["items"] if document.get("kind") == "List" else [document]
+        results = []
+        for item in items:
+            self.request()
+            metadata = item.setdefault("metadata", {})
+            if not metadata.get("name"):
+                metadata["name"] = (
+                    metadata.get("generateName", "obj-") + uuid.uuid4().hex[:5]
+                )
+            ns = metadata.get("namespace", namespace)
+            key = (item["kind"].lower(), ns, metadata["name"])
+            with self.lock:
+                if key in self.objects and verb == "create":
+                    raise KubectlError(
+                        f'Error from server (AlreadyExists): {item["kind"]} '
+                        f'"{metadata["name"]}" already exists'
+                    )
+                self.resource_version += 1
+                current = self.objects.get(key, {}).get("metadata", {})
+                metadata.update(
+                    namespace=ns,
+                    uid=current.get("uid", str(uuid.uuid4())),
+                    resourceVersion=str(self.resource_version),
+                    selfLink=f"/api/v1/namespaces/{ns}/{key[0]}s/{metadata['name']}",
+                )
+                self.objects[key] = item
+            results.append(item)
+        if len(results) == 1:
+            return json.dumps(results[0])
+        return json.dumps({"apiVersion": "v1", "kind": "List", "items": results})
+
+    def get(self, positional, namespace, output, raw=None):
+        if raw:
+            # discovery document, one resource per kind stored so far
+            self.request()
+            with self.lock:
+                kinds = {o["kind"] for o in self.objects.values()}
+            resources = [
+                {"name": f"{k.lower()}s", "kind": k, "namespaced": True} for k in kinds
+            ]
+            return json.dumps(
+                {"groupVersion": raw.split("/", 2)[-1], "resources": resources}
+            )
+        target = positional[0].lower()
+        if "/" in target:
+            kind, name = target.split("/", 1)
+            self.request()
+            obj = self.objects.get((kind, namespace, name))
+            if obj is None:
+                raise KubectlError(
+                    f'Error from server (NotFound): {kind} "{name}" not found'
+                )
+            if output.startswith("jsonpath"):
+                return obj["metadata"]["uid"]
+            return json.dumps(obj)
+        with self.lock:
+            items = [
+                o
+                for (k, ns, _n), o in self.objects.items()
+                if k == target and ns == namespace
+            ]
+        self.stats.incr("apiserver list items", len(items))
+        self.request(self.list_cost * len(items))
+        return json.dumps({"kind": "List", "items": items})
+
+    def delete(self, positional, namespace, flags, manifest):
+        self.request()
+        with self.lock:
+            if "--raw" in flags:
+                uid = json.loads(manifest)["preconditions"]["uid"]
+                keys = [
+                    k
+                    for k, o in self.objects.items()
+                    if o["metadata"]["selfLink"] == flags["--raw"]
+                ]
+                if keys and self.objects[keys[0]]["metadata"]["uid"] != uid:
+                    raise KubectlError(
+                        "Error from server (Conflict): Precondition failed: UID"
+                    )
+            elif positional:
+                kind, name = positional[0].lower().split("/", 1)
+                keys = [(kind, namespace, name)]
+            else:
+                document = json.loads(manifest)
+                items = document.get("items", [document])
+                keys = [
+                    (i["kind"].lower(), namespace, i["metadata"].get("name"))
+                    for i in items
+                ]
+            keys = [k for k in keys if k in self.objects]
+            if not keys and "--ignore-not-found" in flags:
+                return ""
+            if not keys:
+                raise KubectlError("Error from server (NotFound): not found")
+            for key in keys:
+                del self.objects[key]
+        return ""
+
+    def check_output(self, args, stderr=None):
+        # stand-in for subprocess.check_output in the handler modules
+        command = " ".join(shlex.quote(a) for a in args)
+        manifest = None
+        if "-f" in args:
+            with self.tmp.open(args[args.index("-f") + 1]) as fh:
+                manifest = fh.read()
+        try:
+            return self.kubectl(command, manifest).encode("utf-8")
+        except KubectlError as e:
+            raise subprocess.CalledProcessError(1, args, output=str(e).encode("utf-8"))
+
+
+def code_sha256(code):
+    return base64.b64encode(hashlib.sha256(code).digest()).decode("utf-8")
+
+
+class FakeFunction:
+    def __init__(self, name, config):
+        self.name = name
+        self.config = config
+        self.busy_until = 0.0
+        self.revision = 0
+        self.warm = 0
+        self.running = 0
+        self.reserved = None
+        self.layers = config.get("Layers", [])
+
+
+class FakeLambda:
+    exceptions = types.SimpleNamespace(
+        ResourceConflictException=ResourceConflictException,
+        PreconditionFailedException=PreconditionFailedException,
+        ResourceNotFoundException=ResourceNotFoundException,
+        TooManyRequestsException=TooManyRequestsException,
+    )
+
+    def __init__(self, cloud):
+        self.cloud = cloud
+        self.clock = cloud.clock
+        self.stats = cloud.stats
+        self.lock = threading.Lock()
+        self.functions = {}
+        self.layers = []
+        self.permissions = set()
+
+    def function(self, name):
+        if name not in self.functions:
+            raise ResourceNotFoundException(f"Function not found: {name}")
+        return self.functions[name]
+
+    def mutate(self, name, seconds, revision_id=None):
+        # lambda only allows one create/update at a time per function
+        self.stats.incr("lambda mutations")
+        with self.lock:
+            fn = self.function(name)
+            if revision_id is not None and revision_id != str(fn.revision):
+                self.stats.incr("lambda precondition failures")
+                raise PreconditionFailedException(
+                    "The Revision Id provided does not match the latest Revision Id."
+                )
+            if time.monotonic() < fn.busy_until:
+                self.stats.incr("lambda conflicts")
+                raise ResourceConflictException(
+                    "The operation cannot be performed at this time. An update is in "
+                    f"progress for resource: {name}"
+                )
+            fn.busy_until = time.monotonic() + seconds * self.clock.scale
+            fn.revision += 1
+            fn.warm = 0
+            return fn
+
+    def create_function(self, FunctionName, **config):
+        self.stats.incr("lambda create_function")
+        with self.lock:
+            if FunctionName in self.functions:
+                self.stats.incr("lambda conflicts")
+                raise ResourceConflictException(
+                    f"Function already exist: {FunctionName}"
+                )
+            config["CodeSha256"] = code_sha256(config.pop("Code")["ZipFile"])
+            self.functions[FunctionName] = FakeFunction(FunctionName, config)
+        self.mutate(FunctionName, self.cloud.update_seconds)
+        return self.get_function_configuration(FunctionName)
+
+    def update_function_code(self, FunctionName, ZipFile, RevisionId=None):
+        self.stats.incr("lambda update_function_code")
+        fn = self.mutate(FunctionName, self.cloud.update_seconds, RevisionId)
+        fn.config["CodeSha256"] = code_sha256(ZipFile)
+        return self.get_function_configuration(FunctionName)
+
+    def update_function_configuration(self, FunctionName, RevisionId=None, **config):
+        self.stats.incr("lambda update_function_configuration")
+        fn = self.mutate(FunctionName, self.cloud.update_seconds, RevisionId)
+        fn.config.update(config)
+        return self.get_function_configuration(FunctionName)
+
+    def get_function_configuration(self, FunctionName, **_kwargs):
+        self.stats.incr("lambda get_function_configuration")
+        if FunctionName == HANDLER_FUNCTION:
+            return {"FunctionName": FunctionName, "VpcConfig": {}}
+        fn = self.function(FunctionName)
+        in_progress = time.monotonic() < fn.busy_until
+        return dict(
+            fn.config,
+            FunctionName=FunctionName,
+            FunctionArn=f"arn:aws:lambda:us-east-1:123456789012:function:{FunctionName}",
+            RevisionId=str(fn.revision),
+            State="Active",
+            LastUpdateStatus="InProgress" if in_progress else "Successful",
+            Layers=[{"Arn": a} for a in fn.config.get("Layers", [])],
+        )
+
+    def put_function_event_invoke_config(self, FunctionName, **config):
+        self.stats.incr("lambda put_function_event_invoke_config")
+        self.function(FunctionName).config["EventInvokeConfig"] = config
+
+    def get_function_concurrency(self, FunctionName):
+        reserved = self.function(FunctionName).reserved
+        return {"ReservedConcurrentExecutions": reserved} if reserved else {}
+
+    def put_function_concurrency(self, FunctionName, ReservedConcurrentExecutions):
+        self.stats.incr("lambda put_function_concurrency")
+        self.function(FunctionName).reserved = ReservedConcurrentExecutions
+
+    def delete_function_concurrency(self, FunctionName):
+        self.function(FunctionName).reserved = None
+
+    def get_function(self, FunctionName, **_kwargs):
+        return {"Configuration": self.get_function_configuration(FunctionName)}
+
+    def add_permission(self, FunctionName, StatementId, **_kwargs):
+        with self.lock:
+            if (FunctionName, StatementId) in self.permissions:
+                raise ResourceConflictException(
+                    f"The statement id ({StatementId}) provided already exists."
+                )
+            self.permissions.add((FunctionName, StatementId))
+
+    def get_paginator(self, operation):
+        assert operation == "list_layer_versions"
+        return types.SimpleNamespace(
+            paginate=lambda LayerName: [
+                {
+                    "LayerVersions": [
+                        v for v in self.layers if v["LayerName"] == LayerName
+                    ]
+                }
+            ]
+        )
+
+    def get_layer_version_by_arn(self, Arn):
+        for version in self.layers:
+            if version["LayerVersionArn"] == Arn:
+                return version
+        raise ResourceNotFoundException(f"Layer version not found: {Arn}")
+
+    def publish_layer_version(self, LayerName, Description, **_kwargs):
+        self.stats.incr("lambda publish_layer_version")
+        with self.lock:
+            version = {
+                "LayerName": LayerName,
+                "Description": Description,
+                "LayerVersionArn": f"arn:aws:lambda:us-east-1:123456789012:layer:"
+                f"{LayerName}:{len(self.layers) + 1}",
+            }
+            self.layers.append(version)
+        return version
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        self.stats.incr("lambda invoke")
+        event = json.loads(Payload)
+        fn = self.function(FunctionName)
+        with self.lock:
+            if fn.reserved and fn.running >= fn.reserved and not event.get("warmup"):
+                self.stats.incr("lambda throttled invokes")
+                raise TooManyRequestsException("Rate Exceeded.")
+            fn.running += 1
+            cold = fn.running > fn.warm
+            if cold:
+                fn.warm += 1
+        if cold:
+            self.stats.incr("proxy cold starts")
+            self.clock.sleep(self.cloud.cold_start)
+        try:
+            if InvocationType == "Event":
+                threading.Thread(target=self.run_async, args=(event,)).start()
+                return {"StatusCode": 202}
+            return {"Payload": io.BytesIO(json.dumps(self.run(event)).encode("utf-8"))}
+        finally:
+            with self.lock:
+                fn.running -= 1
+
+    def run(self, event):
+        # what the proxy's proxy_wrap does, minus the kubeconfig setup
+        try:
+            if "command" in event:
+                return self.cloud.apiserver.kubectl(
+                    event["command"], event.get("manifest")
+                )
+            kind_name = event["Name"]
+            output = self.cloud.apiserver.kubectl(
+                f'kubectl get {kind_name} -o jsonpath="{event["JsonPath"]}" '
+                f'--namespace {event["Namespace"]}'
+            )
+            return dict(event, Response=output, Id=output)
+        except Exception as e:
+            return {"errorType": type(e).__name__, "errorMessage": str(e)}
+
+    def run_async(self, event):
+        result = self.run(event)
+        if isinstance(result, str):
+            result = apply_handlers.model_output(result)
+        apply_vpc.put_proxy_result(
+            event["cluster_name"], event["operation_id"], result, self.cloud.session
+        )
+
+
+class FakeSSM:
+    exceptions = types.SimpleNamespace(ParameterNotFound=ParameterNotFound)
+
+    def __init__(self):
+        self.parameters = {}
+
+    def put_parameter(self, Name, Value, **_kwargs):
+        self.parameters[Name] = Value
+
+    def get_parameter(self, Name, **_kwargs):
+        if Name not in self.parameters:
+            raise ParameterNotFound(Name)
+        return {"Parameter": {"Name": Name, "Value": self.parameters[Name]}}
+
+    def delete_parameter(self, Name):
+        self.parameters.pop(Name, None)
+
+
+class FakeCloud:
+    def __init__(self, args, stats):
+        self.stats = stats
+        self.clock = Clock(args.time_scale, stats)
+        self.update_seconds = args.update_seconds
+        self.cold_start = args.cold_start
+        self.apiserver = FakeApiServer(
+            self.clock, stats, args.api_latency, args.list_cost
+        )
+        self.lmbd = FakeLambda(self)
+        self.ssm = FakeSSM()
+        vpc_config = {
+            "subnetIds": ["subnet-1", "subnet-2"],
+            "securityGroupIds": ["sg-1"],
+            "endpointPublicAccess": args.public_endpoint,
+            "publicAccessCidrs": ["0.0.0.0/0"] if args.public_endpoint else [],
+        }
+        cluster = {
+            "name": CLUSTER,
+            "version": "1.16",
+            "platformVersion": "eks.1",
+            "endpoint": "https://stress.eks.example.invalid",
+            "certificateAuthority": {"data": ""},
+            "resourcesVpcConfig": vpc_config,
+        }
+        self.clients = {
+            "lambda": self.lmbd,
+            "ssm": self.ssm,
+            "eks": types.SimpleNamespace(
+                describe_cluster=self.api("eks describe_cluster", {"cluster": cluster})
+            ),
+            "ec2": types.SimpleNamespace(
+                describe_subnets=self.api(
+                    "ec2 describe_subnets",
+                    {"Subnets": [{"SubnetId": s} for s in vpc_config["subnetIds"]]},
+                )
+            ),
+            "sts": types.SimpleNamespace(
+                get_caller_identity=self.api(
+                    "sts get_caller_identity",
+                    {"Arn": "arn:aws:sts::123456789012:assumed-role/stress/session"},
+                ),
+                generate_presigned_url=self.api(
+                    "sts presign", "https://sts.amazonaws.com/?Action=GetCallerIdentity"
+                ),
+                meta=types.SimpleNamespace(
+                    events=types.SimpleNamespace(register=lambda *_a, **_kw: None)
+                ),
+            ),
+            "events": types.SimpleNamespace(
+                put_rule=self.api("events put_rule", {"RuleArn": "arn:rule"}),
+                put_targets=self.api("events put_targets", {}),
+                get_paginator=lambda _operation: types.SimpleNamespace(
+                    paginate=self.api("events list_rules", [{"Rules": []}])
+                ),
+            ),
+            "s3": types.SimpleNamespace(),
+        }
+        self.session = types.SimpleNamespace(
+            client=lambda name, **_kw: self.clients[name]
+        )
+
+    def api(self, name, response):
+        def call(*_args, **_kwargs):
+            self.stats.incr(name)
+            self.clock.sleep(0.05)
+            return response
+
+        return call
+
+
+environment = threading.local()
+
+
+def environment_id():
+    # Concurrent handler invocations run in separate Lambda execution environments.
+    # The harness runs each one on a thread of its own, threads started by a handler
+    # belong to the environment of the thread that started them.
+    return getattr(environment, "id", threading.get_ident())
+
+
+class EnvironmentExecutor(ThreadPoolExecutor):
+    # stand-in for ThreadPoolExecutor in the handler modules
+    def submit(self, fn, *args, **kwargs):
+        env = environment_id()
+
+        def run():
+            environment.id = env
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                del environment.id
+
+        return super().submit(run)
+
+
+class PrivateTmp:
+    # each simulated execution environment gets its own /tmp
+    def __init__(self, workdir):
+        self.workdir = workdir
+
+    def path(self, path):
+        if not str(path).startswith("/tmp/"):
+            return path
+        directory = os.path.join(self.workdir, f"tmp-{environment_id()}")
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, str(path)[len("/tmp/") :])
+
+    def open(self, path, *args, **kwargs):
+        return open(self.path(path), *args, **kwargs)
+
+    def module(self, module):
+        # stand-in for os/os.path in the handler modules
+        namespace = types.SimpleNamespace(**vars(module))
+        namespace.exists = lambda path: os.path.exists(self.path(path))
+        namespace.path = types.SimpleNamespace(**vars(os.path))
+        namespace.path.exists = namespace.exists
+        return namespace
+
+
+class PerEnvironment:
+    # module level state of a handler, private to one simulated execution environment
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.environments = {}
+
+    @property
+    def values(self):
+        with self.lock:
+            return self.environments.setdefault(environment_id(), {})
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def pop(self, key, default=None):
+        return self.values.pop(key, default)
+
+    def setdefault(self, key, default):
+        return self.values.setdefault(key, default)
+
+    def __setitem__(self, key, value):
+        self.values[key] = value
+
+
+def install(cloud, workdir):
+    os.chdir(workdir)
+    for package in ("awsqs_kubernetes_resource", "awsqs_kubernetes_get"):
+        os.makedirs(package, exist_ok=True)
+        with open(os.path.join(package, "vpc.zip"), "wb") as fh:
+            fh.write(b"stress")
+        with open(os.path.join(package, "layer.sha256"), "w") as fh:
+            fh.write("stress")
+    os.environ["AWS_LAMBDA_FUNCTION_NAME"] = HANDLER_FUNCTION
+    fake_boto3 = types.SimpleNamespace(
+        client=lambda name, **_kw: cloud.clients[name], Session=object
+    )
+    fake_time = types.SimpleNamespace(
+        sleep=cloud.clock.retry_sleep, time=time.time, monotonic=time.monotonic
+    )
+    for module in (apply_vpc, get_vpc):
+        module.boto3 = fake_boto3
+        module.time = fake_time
+        module.deployed = PerEnvironment()
+        module.deploy_locks = PerEnvironment()
+        module.clusters = PerEnvironment()
+        module.probes = PerEnvironment()
+        module.settings_cache = PerEnvironment()
+        module.profiling.switches = PerEnvironment()
+        module.probe_endpoint = cloud.api("endpoint probes", True)
+        module.throttle.buckets = PerEnvironment()
+    apply_handlers.sleep = cloud.clock.retry_sleep
+    get_handlers.time = fake_time
+    apply_handlers.ThreadPoolExecutor = EnvironmentExecutor
+    for module in (apply_handlers, get_handlers):
+        module.open = cloud.tmp.open
+        module.os = cloud.tmp.module(os)
+        module.subprocess = types.SimpleNamespace(
+            check_output=cloud.apiserver.check_output,
+            CalledProcessError=subprocess.CalledProcessError,
+            STDOUT=subprocess.STDOUT,
+        )
+        module.proxy_session = cloud.session
+
+
+def drive(cloud, handlers, request):
+    # runs each handler through its callbacks, as CloudFormation would
+    start = time.monotonic()
+    for handler in handlers:
+        callback_context = {}
+        while True:
+            progress = handler(cloud.session, request, callback_context)
+            if progress.status != OperationStatus.IN_PROGRESS:
+                break
+            callback_context = progress.callbackContext or {}
+            cloud.clock.sleep(progress.callbackDelaySeconds or 0)
+        if progress.status != OperationStatus.SUCCESS:
+            raise Exception(progress.message)
+    return time.monotonic() - start
+
+
+def apply_request(i):
+    manifest = {
+        "apiVersion": "v1",
+        "kind": "ConfigMap",
+        "metadata": {"name": f"stress-{i}"},
+        "data": {"index": str(i)},
+    }
+    model = ApplyModel._deserialize(
+        {
+            "ClusterName": CLUSTER,
+            "Namespace": "default",
+            "Manifest": json.dumps(manifest),
+        }
+    )
+    return [apply_handlers.create_handler], types.SimpleNamespace(
+        desiredResourceState=model,
+        previousResourceState=None,
+        clientRequestToken=str(uuid.uuid4()),
+        logicalResourceIdentifier=f"Resource{i}",
+    )
+
+
+def get_request(i, resources):
+    model = GetModel._deserialize(
+        {
+            "ClusterName": CLUSTER,
+            "Namespace": "default",
+            "Name": f"configmap/stress-{i % max(resources, 1)}",
+            "JsonPath": "{.metadata.uid}",
+        }
+    )
+    return [
+        get_handlers.create_handler,
+        get_handlers.read_handler,
+    ], types.SimpleNamespace(
+        desiredResourceState=model,
+        previousResourceState=None,
+        clientRequestToken=str(uuid.uuid4()),
+        logicalResourceIdentifier=f"Get{i}",
+    )
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--resources", type=int, default=100, help="Resource creates")
+    parser.add_argument("--gets", type=int, default=50, help="Get reads")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument(
+        "--time-scale",
+        type=float,
+        default=0.02,
+        help="multiplier applied to every simulated delay and sleep",
+    )
+    parser.add_argument("--update-seconds", type=float, default=5.0)
+    parser.add_argument("--cold-start", type=float, default=8.0)
+    parser.add_argument("--api-latency", type=float, default=0.05)
+    parser.add_argument("--list-cost", type=float, default=0.001)
+    parser.add_argument(
+        "--stale-proxy",
+        action="store_true",
+        help="start with proxy functions deployed from an older build",
+    )
+    parser.add_argument(
+        "--public-endpoint",
+        action="store_true",
+        help="give the cluster a public endpoint that the handlers can reach",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=0,
+        help="MaxConcurrency in the cluster's proxy config",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    logging.disable(logging.CRITICAL)
+    stats = Stats()
+    cloud = FakeCloud(args, stats)
+    workdir = tempfile.mkdtemp(prefix="awsqs-stress-")
+    cloud.tmp = cloud.apiserver.tmp = PrivateTmp(workdir)
+    install(cloud, workdir)
+    if args.stale_proxy:
+        for proxy in ("apply", "get"):
+            name = f"awsqs-kubernetes-resource-{proxy}-proxy-{CLUSTER}"
+            cloud.lmbd.functions[name] = FakeFunction(name, {"CodeSha256": "stale"})
+    if args.max_concurrency:
+        cloud.ssm.put_parameter(
+            Name=f"{apply_vpc.PROXY_CONFIG_PREFIX}/{CLUSTER}",
+            Value=json.dumps({"MaxConcurrency": args.max_concurrency}),
+        )
+
+    resources = [apply_request(i) for i in range(args.resources)]
+    gets = [get_request(i, args.resources) for i in range(args.gets)]
+    latencies, errors = [], Counter()
+
+    def run(item):
+        handlers, request = item
+        try:
+            latencies.append(drive(cloud, handlers, request) / args.time_scale)
+        except Exception as e:
+            errors[str(e).split("\n")[0][:120]] += 1
+            return
+        # a resource that ends up tracking another resource's object
+        expected = request.logicalResourceIdentifier.replace("Resource", "stress-")
+        if handlers[0] is apply_handlers.create_handler:
+            if request.desiredResourceState.Name != expected:
+                stats.incr("model mismatches")
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        # Gets read the resources' objects, so like a DependsOn they start once
+        # the resources have been created
+        list(executor.map(run, resources))
+        list(executor.map(run, gets))
+    elapsed = (time.monotonic() - start) / args.time_scale
+
+    counters = stats.counters
+    mutations = counters["lambda mutations"] + counters["lambda create_function"]
+    report = {
+        "operations": len(resources) + len(gets),
+        "succeeded": len(latencies),
+        "failed": sum(errors.values()),
+        "simulated_seconds": round(elapsed, 1),
+        "throughput_per_minute": round(len(latencies) / elapsed * 60, 1),
+        "latency_seconds": {
+            "p50": round(percentile(latencies, 50), 1),
+            "p90": round(percentile(latencies, 90), 1),
+            "p99": round(percentile(latencies, 99), 1),
+            "max": round(max(latencies, default=0), 1),
+            "mean": round(statistics.mean(latencies), 1) if latencies else 0,
+        },
+        "retry_sleeps": dict(stats.retry_sleeps),
+        "lambda_conflicts": counters["lambda conflicts"],
+        "lambda_conflict_rate": (
+            round(counters["lambda conflicts"] / mutations, 3) if mutations else 0
+        ),
+        "counters": dict(sorted(counters.items())),
+        "errors": dict(errors),
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    for key, value in report.items():
+        if isinstance(value, dict):
+            print(f"{key}:")
+            for k, v in value.items():
+                print(f"  {k}: {v}")
+        else:
+            print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()